@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+
+# python-fritzbox - Automate the Fritz!Box with python
+# Copyright (C) 2015-2024 Patrick Ammann <pammann@gmx.net>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+#
+
+import os
+import sys
+import time
+import random
+import argparse
+import threading
+import urllib.parse
+import xml.etree.ElementTree as ET
+from xml.sax.saxutils import escape
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import generate
+
+
+BOOK_PATH = "/dav/addressbooks/users/bench/contacts/"
+PRINCIPAL_PATH = "/dav/principals/users/bench/"
+HOME_PATH = "/dav/addressbooks/users/bench/"
+NS_DAV = "{DAV:}"
+NS_CARDDAV = "{urn:ietf:params:xml:ns:carddav}"
+
+
+def make_vcard(i, given, family, home, mobile, work, email, vip):
+    lines = ["BEGIN:VCARD", "VERSION:3.0", "UID:%08d-synthetic" % i,
+             "N:%s;%s;;;" % (family, given), "FN:%s %s" % (given, family)]
+    if vip: lines.append("CATEGORIES:%s" % generate.VIP_GROUP)
+    lines.append("TEL;TYPE=HOME,VOICE:%s" % home)
+    lines.append("TEL;TYPE=CELL:%s" % mobile)
+    if work: lines.append("TEL;TYPE=WORK:%s" % work)
+    lines.append("EMAIL;TYPE=HOME:%s" % email)
+    lines.append("END:VCARD")
+    return "\r\n".join(lines) + "\r\n"
+
+
+# Minimal CardDAV server serving one address book with synthetic vCards.
+# Supports PROPFIND, GET and the REPORTs addressbook-multiget and sync-collection.
+class CardDAVServer(object):
+    # n: number of vCards
+    # latency: seconds added to each request
+    # failure_rate: part of vCard GET requests answered with 500
+    def __init__(self, n, latency=0.0, failure_rate=0.0, port=0, sync=True, multiget=True):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.sync = sync
+        self.multiget = multiget
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._random = random.Random(0)
+        self.cards = {}  # href -> (etag, vcard)
+        self.version = 0
+        self._changes = []  # (version, href)
+        for i, contact in enumerate(generate.Contacts(n)):
+            self.cards["%s%08d.vcf" % (BOOK_PATH, i)] = ("\"%d-0\"" % i, make_vcard(i, *contact))
+        server = self
+        class Handler(_Handler):
+            dav = server
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:%d%s" % (self._httpd.server_address[1], BOOK_PATH)
+
+    @property
+    def principal_url(self):
+        return "http://127.0.0.1:%d%s" % (self._httpd.server_address[1], PRINCIPAL_PATH)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def sync_token(self):
+        return "http://127.0.0.1/sync/%d" % self.version
+
+    # change the vCard with the given index, or add it if not there
+    def update_card(self, i, given="Changed"):
+        with self._lock:
+            self.version += 1
+            href = "%s%08d.vcf" % (BOOK_PATH, i)
+            vcard = make_vcard(i, given, "Card", "044 000 00 %02d" % (i % 100), "+41 79 000 00 00", "", "c%d@example.com" % i, False)
+            self.cards[href] = ("\"%d-%d\"" % (i, self.version), vcard)
+            self._changes.append((self.version, href))
+
+    def delete_card(self, i):
+        with self._lock:
+            self.version += 1
+            href = "%s%08d.vcf" % (BOOK_PATH, i)
+            self.cards.pop(href, None)
+            self._changes.append((self.version, href))
+
+    # returns None for an unknown token, else the hrefs changed since the token
+    def changes_since(self, token):
+        with self._lock:
+            if not token:
+                return list(self.cards.keys())
+            prefix = "http://127.0.0.1/sync/"
+            if not token.startswith(prefix) or not token[len(prefix):].isdigit():
+                return None
+            version = int(token[len(prefix):])
+            if version > self.version:
+                return None
+            return list(dict.fromkeys(href for v, href in self._changes if v > version))
+
+    def fail(self):
+        with self._lock:
+            return self._random.random() < self.failure_rate
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    dav = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _begin(self):
+        with self.dav._lock:
+            self.dav.requests += 1
+        if self.dav.latency:
+            time.sleep(self.dav.latency)
+        length = int(self.headers.get("Content-Length", 0))
+        return self.rfile.read(length) if length else b""
+
+    def _send(self, status, body, content_type="application/xml; charset=utf-8"):
+        data = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("DAV", "1, 2, 3, addressbook, extended-mkcol")
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        try:
+            self.wfile.write(data)
+        except (BrokenPipeError, ConnectionResetError):
+            # client went away, e.g. cancelled download
+            self.close_connection = True
+
+    def _path(self):
+        return urllib.parse.urlparse(self.path).path
+
+    def do_GET(self):
+        self._begin()
+        card = self.dav.cards.get(self._path())
+        if card is None:
+            self._send(404, "not found", "text/plain")
+        elif self.dav.fail():
+            self._send(500, "simulated failure", "text/plain")
+        else:
+            self._send(200, card[1], "text/vcard; charset=utf-8")
+
+    def _propstat(self, props):
+        return ("<d:propstat><d:prop>%s</d:prop><d:status>HTTP/1.1 200 OK</d:status></d:propstat>" % props)
+
+    def _card_response(self, href, etag, data=None):
+        props = "<d:getetag>%s</d:getetag><d:getcontenttype>text/vcard; charset=utf-8</d:getcontenttype>" % escape(etag)
+        if data is not None:
+            props += "<card:address-data>%s</card:address-data>" % escape(data)
+        return "<d:response><d:href>%s</d:href>%s</d:response>" % (escape(href), self._propstat(props))
+
+    def _multistatus(self, responses, sync_token=None):
+        body = '<?xml version="1.0" encoding="utf-8"?>\n'
+        body += '<d:multistatus xmlns:d="DAV:" xmlns:card="urn:ietf:params:xml:ns:carddav">'
+        body += "".join(responses)
+        if sync_token: body += "<d:sync-token>%s</d:sync-token>" % escape(sync_token)
+        body += "</d:multistatus>"
+        self._send(207, body)
+
+    def do_PROPFIND(self):
+        self._begin()
+        path = self._path()
+        depth = self.headers.get("Depth", "1")
+        if path == PRINCIPAL_PATH or path == "/dav/":
+            props = ("<d:current-user-principal><d:href>%s</d:href></d:current-user-principal>"
+                     "<card:addressbook-home-set><d:href>%s</d:href></card:addressbook-home-set>" % (PRINCIPAL_PATH, HOME_PATH))
+            self._multistatus(["<d:response><d:href>%s</d:href>%s</d:response>" % (path, self._propstat(props))])
+        elif path == HOME_PATH:
+            responses = ["<d:response><d:href>%s</d:href>%s</d:response>" % (HOME_PATH, self._propstat("<d:resourcetype><d:collection/></d:resourcetype>"))]
+            if depth != "0":
+                responses.append("<d:response><d:href>%s</d:href>%s</d:response>" % (BOOK_PATH, self._propstat(
+                    "<d:resourcetype><d:collection/><card:addressbook/></d:resourcetype><d:displayname>Contacts</d:displayname>")))
+            self._multistatus(responses)
+        elif path == BOOK_PATH:
+            props = "<d:resourcetype><d:collection/><card:addressbook/></d:resourcetype>"
+            if self.dav.sync: props += "<d:sync-token>%s</d:sync-token>" % self.dav.sync_token()
+            responses = ["<d:response><d:href>%s</d:href>%s</d:response>" % (BOOK_PATH, self._propstat(props))]
+            if depth != "0":
+                for href, (etag, vcard) in list(self.dav.cards.items()):
+                    responses.append(self._card_response(href, etag))
+            self._multistatus(responses)
+        else:
+            self._send(404, "not found", "text/plain")
+
+    def do_REPORT(self):
+        body = self._begin()
+        if self._path() != BOOK_PATH:
+            self._send(404, "not found", "text/plain")
+            return
+        root = ET.fromstring(body)
+        if root.tag == NS_CARDDAV + "addressbook-multiget" and self.dav.multiget:
+            # strict as RFC 6352 8.7
+            if self.headers.get("Depth", "0") != "0":
+                self._send(400, "addressbook-multiget needs Depth: 0", "text/plain")
+                return
+            responses = []
+            for href in root.iter(NS_DAV + "href"):
+                card = self.dav.cards.get(href.text)
+                if card is None or self.dav.fail():
+                    status = "404 Not Found" if card is None else "500 Internal Server Error"
+                    responses.append("<d:response><d:href>%s</d:href><d:status>HTTP/1.1 %s</d:status></d:response>" % (escape(href.text), status))
+                else:
+                    responses.append(self._card_response(href.text, card[0], card[1]))
+            self._multistatus(responses)
+        elif root.tag == NS_DAV + "sync-collection" and self.dav.sync:
+            token = root.findtext(NS_DAV + "sync-token")
+            changed = self.dav.changes_since(token)
+            if changed is None:
+                self._send(403, '<?xml version="1.0" encoding="utf-8"?><d:error xmlns:d="DAV:"><d:valid-sync-token/></d:error>')
+                return
+            responses = []
+            for href in changed:
+                card = self.dav.cards.get(href)
+                if card is None:
+                    responses.append("<d:response><d:href>%s</d:href><d:status>HTTP/1.1 404 Not Found</d:status></d:response>" % escape(href))
+                else:
+                    responses.append(self._card_response(href, card[0]))
+            self._multistatus(responses, self.dav.sync_token())
+        else:
+            self._send(501, "not implemented", "text/plain")
+
+
+#
+# main
+#
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local CardDAV server with synthetic vCards")
+    parser.add_argument("--count", type=int, default=1000,
+        help="number of vCards")
+    parser.add_argument("--port", type=int, default=8008)
+    parser.add_argument("--latency", type=float, default=0.0,
+        help="seconds added to each request")
+    parser.add_argument("--failure-rate", dest="failure_rate", type=float, default=0.0,
+        help="part of vCard requests failing with 500, e.g. 0.01")
+    parser.add_argument("--no-multiget", dest="multiget", action="store_false", default=True,
+        help="answer addressbook-multiget REPORT with 501")
+    parser.add_argument("--no-sync", dest="sync", action="store_false", default=True,
+        help="answer sync-collection REPORT with 501")
+    args = parser.parse_args()
+
+    server = CardDAVServer(args.count, args.latency, args.failure_rate, args.port, sync=args.sync, multiget=args.multiget)
+    print("serving %d vCards on %s" % (args.count, server.url))
+    try:
+        server._httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+
+# python-fritzbox - Automate the Fritz!Box with python
+# Copyright (C) 2015-2024 Patrick Ammann <pammann@gmx.net>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+#
+
+# Checks that the fast vCard parser (fritzbox.vcard) gives the same contacts and warnings
+# as vobject: each card is converted with fritzbox.VCF.Import.get_books_by_cards once per
+# parser. Cards are the generated VCF files, the edge cases below and the given files.
+# Exit code 1 on any difference.
+
+import os
+import sys
+import logging
+import argparse
+import tempfile
+
+# fritzbox and benchmark modules
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import generate
+import vobject
+import fritzbox.VCF
+import fritzbox.vcard
+
+
+SIZES = {"1k": 1000, "10k": 10000, "100k": 100000}
+VIP_GROUPS = [generate.VIP_GROUP]
+FORMATS = ["vcf", "vcf-photo"]
+
+# cards with the syntax the fast parser has to handle like vobject (or leave to vobject)
+EDGE_CASES = [
+    # quoted-printable with charset (vCard 2.1)
+    "BEGIN:VCARD\r\nVERSION:2.1\r\n"
+    "N;CHARSET=ISO-8859-1;ENCODING=QUOTED-PRINTABLE:M=FCller;J=FCrg;;;\r\n"
+    "TEL;HOME;VOICE:+41 44 123 45 67\r\nEND:VCARD\r\n",
+    "BEGIN:VCARD\r\nVERSION:2.1\r\n"
+    "N;CHARSET=UTF-8;QUOTED-PRINTABLE:Z=C3=BCrcher;K=C3=A4thi\r\n"
+    "TEL;CELL:079 123 45 67\r\nEND:VCARD\r\n",
+    "BEGIN:VCARD\r\nVERSION:2.1\r\n"
+    "N;ENCODING=QUOTED-PRINTABLE;CHARSET=windows-1252:Br=FCnner;=80uro;;;\r\n"
+    "TEL;WORK:044 555 55 55\r\nEND:VCARD\r\n",
+    # escaped separators in N and CATEGORIES
+    "BEGIN:VCARD\r\nVERSION:3.0\r\n"
+    "N:Meier\\;Huber;Anna\\,Maria;;;\r\nCATEGORIES:Friends\\,Work,Family\r\n"
+    "TEL;TYPE=HOME:+41 44 111 11 11\r\nEND:VCARD\r\n",
+    "BEGIN:VCARD\r\nVERSION:3.0\r\n"
+    "N:Weber\\\\;Hans\\nPeter;;;\r\nCATEGORIES:Family\\,Friends\r\n"
+    "TEL;TYPE=CELL:+41 79 111 11 11\r\nEND:VCARD\r\n",
+    "BEGIN:VCARD\r\nVERSION:3.0\r\n"
+    "N:Keller;Fritz,Franz;;;\r\n"
+    "TEL;TYPE=CELL:+41 79 222 22 22\r\nEND:VCARD\r\n",
+    # grouped properties (Apple)
+    "BEGIN:VCARD\r\nVERSION:3.0\r\nN:Schmid;Beat;;;\r\n"
+    "item1.TEL;type=pref:+41 44 333 33 33\r\nitem1.X-ABLabel:_$!<Other>!$_\r\n"
+    "item2.EMAIL;type=INTERNET;type=HOME:beat@example.com\r\nitem2.X-ABLabel:private\r\n"
+    "TEL;type=CELL;type=VOICE;type=pref:+41 79 333 33 33\r\nEND:VCARD\r\n",
+    # quoted parameter values
+    "BEGIN:VCARD\r\nVERSION:4.0\r\nN:Huber;Iris;;;\r\n"
+    "TEL;TYPE=\"home,voice\";VALUE=uri:tel:+41-44-444-44-44\r\n"
+    "EMAIL;TYPE=\"home\";PREF=1:iris@example.com\r\nEND:VCARD\r\n",
+    "BEGIN:VCARD\r\nVERSION:3.0\r\nN:Ammann;Lukas;;;\r\n"
+    "TEL;TYPE=WORK;X-LABEL=\"Büro; Zürich\":+41 44 555 55 55\r\nEND:VCARD\r\n",
+    # folding, line ends and case
+    "BEGIN:VCARD\nVERSION:3.0\nN:Schnei\n der;Gabi;;;\nFN:Gabi Schneider\n"
+    "tel;type=home:+41 44 666\n\t66 66\nEND:VCARD\n",
+    "begin:vcard\r\nversion:3.0\r\nn:Brunner;Claudia;;;\r\nemail:claudia@example.com\r\n"
+    "tel;type=fax:+41 44 777 77 77\r\nend:vcard\r\n",
+    # unknown or missing TYPE, FN instead of N, empty values
+    "BEGIN:VCARD\r\nVERSION:3.0\r\nFN:Daniel Müller\r\n"
+    "TEL:+41 44 888 88 88\r\nTEL;TYPE=PAGER:+41 44 888 88 89\r\nEMAIL;TYPE=WORK:d@example.com\r\n"
+    "TEL;TYPE=CELL:\r\nEND:VCARD\r\n",
+    "BEGIN:VCARD\r\nVERSION:3.0\r\nFN:Eva\r\nTEL;TYPE=HOME:044 999 99 99\r\nEND:VCARD\r\n",
+    # backslashes not escaping anything
+    "BEGIN:VCARD\r\nVERSION:3.0\r\nN:Zürcher;Jürg\\x;;;\r\n"
+    "TEL;TYPE=HOME:+41 44 000\\ 00 00\r\nEMAIL;TYPE=HOME:j\\;rg@example.com\r\nEND:VCARD\r\n",
+    # nested card
+    "BEGIN:VCARD\r\nVERSION:2.1\r\nN:Meier;Käthi;;;\r\nTEL;HOME:044 123 00 00\r\n"
+    "AGENT:\r\nBEGIN:VCARD\r\nVERSION:2.1\r\nN:Agent;Secret;;;\r\nTEL;WORK:044 123 00 01\r\nEND:VCARD\r\n"
+    "END:VCARD\r\n",
+]
+
+
+class _Records(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append((record.levelname, record.getMessage()))
+
+
+# returns the converted contacts and the logged messages of the card text, or the exception
+def convert(importer, readOne, text, picture_path, logger, records):
+    del records.records[:]
+    try:
+        books = importer.get_books_by_cards([readOne(text)], VIP_GROUPS, picture_path, logger)
+    except Exception as ex:
+        return "%s: %s" % (type(ex).__name__, ex)
+    contacts = []
+    for book in books.phonebookList:
+        for c in book.contactList:
+            contacts.append((c.category, c.person.givenName, c.person.familyName, c.person.imageURL,
+                             sorted(c.telephony.numberDict.items()),
+                             sorted(c.services.emailDict.items()) if c.services else []))
+    return contacts, list(records.records)
+
+
+def iter_file(filename):
+    importer = fritzbox.VCF.Import()
+    with open(filename, "r", encoding="utf-8", newline="") as infile:
+        yield from importer._iter_card_texts(infile)
+
+
+# returns the number of differences
+def check(label, texts, picture_dir):
+    logger = logging.getLogger("check_vcard")
+    logger.propagate = False
+    records = _Records()
+    logger.handlers = [records]
+    importer = fritzbox.VCF.Import()
+    # one fonpix folder per parser, a reused photo would not log the same warnings
+    fast_path = os.path.join(picture_dir, "fast")
+    vobject_path = os.path.join(picture_dir, "vobject")
+
+    cards = fast = differences = 0
+    for text in texts:
+        cards += 1
+        try:
+            if fritzbox.vcard.parse(text) is not None: fast += 1
+        except Exception:
+            pass
+        got = convert(importer, fritzbox.vcard.readOne, text, fast_path, logger, records)
+        expected = convert(importer, vobject.readOne, text, vobject_path, logger, records)
+        if got != expected:
+            differences += 1
+            if differences <= 10:
+                print("difference in %s, card %d:\n%s  fritzbox.vcard: %r\n  vobject:        %r" % (
+                    label, cards, text, got, expected))
+    print("%-28s %8d cards %8d with the fast parser %6d differences" % (label, cards, fast, differences))
+    return differences
+
+
+#
+# main
+#
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the fast vCard parser with vobject")
+    parser.add_argument("files", nargs="*",
+        help="additional VCF files to check")
+    parser.add_argument("--sizes", nargs="+", choices=list(SIZES.keys()), default=["1k"],
+        help="number of contacts of the generated files")
+    parser.add_argument("--data-dir", dest="data_dir",
+        help="directory for the generated phonebooks, kept between runs. Default is a temporary directory.")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.CRITICAL)
+
+    with tempfile.TemporaryDirectory(prefix="fritzbox-check-") as tmpdir:
+        data_dir = args.data_dir or tmpdir
+        os.makedirs(data_dir, exist_ok=True)
+        differences = check("edge-cases", EDGE_CASES, os.path.join(tmpdir, "edge-cases"))
+        for size in args.sizes:
+            for fmt in FORMATS:
+                filename = generate.get_file(data_dir, fmt, SIZES[size])
+                differences += check("%s/%s" % (fmt, size), iter_file(filename), os.path.join(tmpdir, fmt + size))
+        for filename in args.files:
+            differences += check(filename, iter_file(filename), os.path.join(tmpdir, "file"))
+    sys.exit(1 if differences else 0)
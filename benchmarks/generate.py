@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+
+# python-fritzbox - Automate the Fritz!Box with python
+# Copyright (C) 2015-2024 Patrick Ammann <pammann@gmx.net>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+#
+
+import os
+import sys
+import io
+import base64
+import struct
+import random
+import argparse
+from datetime import datetime
+
+# fritzbox modules
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import fritzbox.phonebook
+
+
+GIVEN_NAMES = ["Anna", "Beat", "Claudia", "Daniel", "Eva", "Fritz", "Gabi", "Hans", "Iris", "Jürg", "Käthi", "Lukas"]
+FAMILY_NAMES = ["Ammann", "Brunner", "Meier", "Müller", "Schmid", "Keller", "Weber", "Huber", "Schneider", "Zürcher"]
+CALL_TYPES = ["Werbung", "Umfrage", "Kostenfalle", "Ping-Anruf", "Seriös"]
+VIP_GROUP = "Family"
+
+
+# deterministic synthetic contacts, about every tenth number repeats an earlier one
+class Contacts(object):
+    def __init__(self, n, seed=0):
+        self.n = n
+        self.seed = seed
+
+    def __iter__(self):
+        rnd = random.Random(self.seed)
+        numbers = []
+        for i in range(self.n):
+            given = "%s%d" % (rnd.choice(GIVEN_NAMES), i)
+            family = rnd.choice(FAMILY_NAMES)
+            if numbers and rnd.random() < 0.1:
+                home = rnd.choice(numbers)
+            else:
+                home = "0%02d %03d %02d %02d" % (rnd.randint(21, 91), rnd.randint(0, 999), rnd.randint(0, 99), rnd.randint(0, 99))
+                if len(numbers) < 10000: numbers.append(home)
+            mobile = "+41 7%d %03d %02d %02d" % (rnd.randint(5, 9), rnd.randint(0, 999), rnd.randint(0, 99), rnd.randint(0, 99))
+            work = "0041 %02d %07d" % (rnd.randint(21, 91), i) if rnd.random() < 0.3 else ""
+            email = "%s.%s@example.com" % (given.lower(), family.lower())
+            vip = rnd.random() < 0.05
+            yield (given, family, home, mobile, work, email, vip)
+
+
+def write_csv(filename, n, style="outlook"):
+    with open(filename, "w", encoding="utf-8", newline="") as f:
+        if style == "outlook":
+            f.write('"First Name","Last Name","Home Phone","Mobile Phone","Business Phone","E-mail Address"\r\n')
+            for given, family, home, mobile, work, email, vip in Contacts(n):
+                f.write('"%s","%s","%s","%s","%s","%s"\r\n' % (given, family, home, mobile, work, email))
+        elif style == "google":
+            f.write("Name,Given Name,Family Name,Group Membership,Home Phone,Mobile Phone,Work Phone,Primary Email\n")
+            for given, family, home, mobile, work, email, vip in Contacts(n):
+                group = "* myContacts ::: %s" % VIP_GROUP if vip else "* myContacts"
+                f.write("%s %s,%s,%s,%s,%s,%s,%s,%s\n" % (given, family, given, family, group, home, mobile, work, email))
+        elif style == "tellows":
+            rnd = random.Random(1)
+            f.write("Nummer;Land;Anruftyp;Score;Suchanfragen\n")
+            for i in range(n):
+                f.write("0%09d;41;%s;%d;%d\n" % (rnd.randint(100000000, 999999999), rnd.choice(CALL_TYPES), rnd.randint(1, 9), rnd.randint(1, 5000)))
+        else:
+            raise ValueError("unknown CSV style: '%s'" % style)
+
+
+def write_ldif(filename, n):
+    vip_members = []
+    with open(filename, "w", encoding="utf-8") as f:
+        for given, family, home, mobile, work, email, vip in Contacts(n):
+            cn = "%s %s" % (given, family)
+            dn = "cn=%s,mail=%s" % (cn, email)
+            if vip: vip_members.append(dn)
+            f.write("dn: %s\nobjectclass: top\nobjectclass: person\nobjectclass: organizationalPerson\n"
+                    "objectclass: inetOrgPerson\nobjectclass: mozillaAbPersonAlpha\n" % dn)
+            f.write("givenName: %s\nsn: %s\ncn: %s\nmail: %s\nhomePhone: %s\nmobile: %s\n" % (given, family, cn, email, home, mobile))
+            if work: f.write("telephoneNumber: %s\n" % work)
+            f.write("\n")
+        f.write("dn: cn=%s\nobjectclass: top\nobjectclass: groupOfNames\ncn: %s\n" % (VIP_GROUP, VIP_GROUP))
+        for dn in vip_members:
+            f.write("member: %s\n" % dn)
+        f.write("\n")
+
+
+def make_photo(size=(320, 240)):
+    from PIL import Image
+    img = Image.new("RGB", size)
+    img.putdata([((x * 7) % 256, (y * 5) % 256, ((x + y) * 3) % 256) for y in range(size[1]) for x in range(size[0])])
+    out = io.BytesIO()
+    img.save(out, "JPEG", quality=85)
+    return out.getvalue()
+
+
+def _fold(line):
+    # vCard lines are folded at 75 octets
+    chunks = [line[0:75]] + [" " + line[i:i + 74] for i in range(75, len(line), 74)]
+    return "\r\n".join(chunks) + "\r\n"
+
+
+# returns the photo with a JPEG comment, so each contact has its own photo bytes
+def _unique_photo(photo, i):
+    comment = b"synthetic %08d" % i
+    return photo[:2] + b"\xff\xfe" + struct.pack(">H", len(comment) + 2) + comment + photo[2:]
+
+
+def _write_card(f, i, contact, photo_data):
+    given, family, home, mobile, work, email, vip = contact
+    f.write("BEGIN:VCARD\r\nVERSION:3.0\r\n")
+    f.write("UID:%08d-synthetic\r\n" % i)
+    f.write("N:%s;%s;;;\r\nFN:%s %s\r\n" % (family, given, given, family))
+    if vip: f.write("CATEGORIES:%s\r\n" % VIP_GROUP)
+    f.write("TEL;TYPE=HOME,VOICE:%s\r\nTEL;TYPE=CELL:%s\r\n" % (home, mobile))
+    if work: f.write("TEL;TYPE=WORK:%s\r\n" % work)
+    f.write("EMAIL;TYPE=HOME:%s\r\n" % email)
+    f.write("NOTE:Synthetic contact %d\\, generated for benchmarks\r\n" % i)
+    if photo_data:
+        photo_b64 = base64.b64encode(_unique_photo(photo_data, i)).decode("ascii")
+        f.write(_fold("PHOTO;ENCODING=b;TYPE=JPEG:%s" % photo_b64))
+    f.write("END:VCARD\r\n")
+
+
+def write_vcf(filename, n, photo=False):
+    photo_data = make_photo() if photo else None
+    with open(filename, "w", encoding="utf-8", newline="") as f:
+        for i, contact in enumerate(Contacts(n)):
+            _write_card(f, i, contact, photo_data)
+
+
+# one file per card in four address books, as written by vdirsyncer
+def write_vcf_dir(dirname, n):
+    for b in range(4):
+        os.makedirs(os.path.join(dirname, "book%d" % b))
+    for i, contact in enumerate(Contacts(n)):
+        filename = os.path.join(dirname, "book%d" % (i % 4), "%08d-synthetic.vcf" % i)
+        with open(filename, "w", encoding="utf-8", newline="") as f:
+            _write_card(f, i, contact, None)
+
+
+def make_phonebooks(n, books=1, seed=0):
+    mod_datetime = datetime(2024, 1, 1)
+    ret = fritzbox.phonebook.Phonebooks()
+    for b in range(books):
+        book = fritzbox.phonebook.Phonebook(name="book%d" % b)
+        for given, family, home, mobile, work, email, vip in Contacts(n, seed + b):
+            person = fritzbox.phonebook.Person(given, family)
+            telephony = fritzbox.phonebook.Telephony()
+            telephony.addNumber("home", home)
+            telephony.addNumber("mobile", mobile)
+            if work: telephony.addNumber("work", work)
+            services = fritzbox.phonebook.Services()
+            services.addEmail("private", email)
+            book.addContact(fritzbox.phonebook.Contact(1 if vip else 0, person, telephony, services, mod_datetime=mod_datetime))
+        ret.addPhonebook(book)
+    return ret
+
+
+def write_xml(filename, n):
+    make_phonebooks(n).write(filename)
+
+
+FORMATS = {
+    "csv-outlook": lambda filename, n: write_csv(filename, n, "outlook"),
+    "csv-google":  lambda filename, n: write_csv(filename, n, "google"),
+    "csv-tellows": lambda filename, n: write_csv(filename, n, "tellows"),
+    "ldif":        write_ldif,
+    "vcf":         write_vcf,
+    "vcf-photo":   lambda filename, n: write_vcf(filename, n, photo=True),
+    "vcf-dir":     write_vcf_dir,
+    "xml":         write_xml,
+}
+
+EXTENSIONS = {
+    "csv-outlook": ".csv", "csv-google": ".csv", "csv-tellows": ".csv",
+    "ldif": ".ldif", "vcf": ".vcf", "vcf-photo": ".vcf", "vcf-dir": "", "xml": ".xml",
+}
+
+
+# changes when generated files change, files of older versions are generated again
+VERSION = 2
+
+
+# returns the file name (a directory for vcf-dir), the file is only generated once per format and size
+def get_file(directory, fmt, n):
+    filename = os.path.join(directory, "%s-%d-v%d%s" % (fmt, n, VERSION, EXTENSIONS[fmt]))
+    if not os.path.exists(filename):
+        tmp = filename + ".tmp"
+        FORMATS[fmt](tmp, n)
+        os.replace(tmp, filename)
+    return filename
+
+
+#
+# main
+#
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate synthetic phonebooks")
+    parser.add_argument("--format", choices=sorted(FORMATS.keys()), required=True)
+    parser.add_argument("--count", type=int, default=1000,
+        help="number of contacts")
+    parser.add_argument("--output", required=True,
+        help="file name")
+    args = parser.parse_args()
+    FORMATS[args.format](args.output, args.count)
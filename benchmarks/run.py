@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+
+# python-fritzbox - Automate the Fritz!Box with python
+# Copyright (C) 2015-2024 Patrick Ammann <pammann@gmx.net>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+#
+
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import shutil
+import resource
+import platform
+import tempfile
+import subprocess
+
+# fritzbox and benchmark modules
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import generate
+
+
+SIZES = {"1k": 1000, "10k": 10000, "100k": 100000, "1M": 1000000}
+VIP_GROUPS = [generate.VIP_GROUP]
+CARDDAV_LATENCY = 0.002  # seconds per request of the local CardDAV server, see --carddav-latency
+LOGGER = logging.getLogger("benchmark")
+
+
+# Each benchmark is a function (data directory, number of contacts) returning a function
+# to measure, all preparation is done before. The measured function returns the number
+# of processed contacts.
+
+def _import(module, fmt, **kwargs):
+    def prepare(directory, n):
+        import importlib
+        importer_module = importlib.import_module(module)
+        importer = importer_module.Import()
+        filename = generate.get_file(directory, fmt, n)
+        picture_path = kwargs.get("picture_path")
+        if picture_path is not None:
+            # photos of earlier runs would be reused
+            picture_path = os.path.join(directory, "fonpix")
+            shutil.rmtree(picture_path, ignore_errors=True)
+        def run():
+            if fmt == "vcf-dir":
+                cache = None
+                if kwargs.get("cached"):
+                    cache = importer_module.VCardFileCache(os.path.join(directory, "vcf-dir.cache"))
+                books = importer.get_books_dir(filename, VIP_GROUPS, None, fast_parser=kwargs.get("fast_parser", False),
+                                               jobs=kwargs.get("jobs", 1), cache=cache, logger=LOGGER)
+            elif module == "fritzbox.VCF":
+                books = importer.get_books(filename, VIP_GROUPS, picture_path,
+                                           fast_parser=kwargs.get("fast_parser", False),
+                                           photo_jobs=kwargs.get("photo_jobs", 1), jobs=kwargs.get("jobs", 1),
+                                           logger=LOGGER)
+            else:
+                books = importer.get_books(filename, VIP_GROUPS, logger=LOGGER)
+            return sum(len(book.contactList) for book in books.phonebookList)
+        if kwargs.get("cached"):
+            # measure the second import, all photos or files are reused
+            if fmt == "vcf-dir" and os.path.exists(os.path.join(directory, "vcf-dir.cache")):
+                os.remove(os.path.join(directory, "vcf-dir.cache"))
+            run()
+        return run
+    return prepare
+
+
+def _normalize(directory, n):
+    books = generate.make_phonebooks(n)
+    def run():
+        books.normalizeNumbers("+41")
+        return n
+    return run
+
+
+def _main_number(directory, n):
+    books = generate.make_phonebooks(n)
+    def run():
+        books.calculateMainNumber()
+        return n
+    return run
+
+
+def _merge(directory, n):
+    # three overlapping sources
+    books = generate.make_phonebooks(n // 3 or 1, books=3)
+    books.normalizeNumbers("+41")
+    def run():
+        books.mergeToOnePhonebook("union")
+        return (n // 3 or 1) * 3
+    return run
+
+
+def _write(directory, n):
+    books = generate.make_phonebooks(n)
+    filename = os.path.join(directory, "write-%d.xml" % n)
+    def run():
+        books.write(filename)
+        return n
+    return run
+
+
+# CardDAV import from the local test server, the measured function also returns the number of requests
+def _carddav(jobs=1, multiget=0, sync=False, cached=False, use_async=False):
+    def prepare(directory, n):
+        import asyncio
+        import carddav_server
+        import fritzbox.CardDAV
+        server = carddav_server.CardDAVServer(n, latency=CARDDAV_LATENCY).start()
+        importer = fritzbox.CardDAV.Import()
+        cache = None
+        if sync or cached:
+            cache = fritzbox.CardDAV.VCardCache(os.path.join(directory, "carddav-%d.cache" % n))
+            importer.get_books(server.url, "bench", "bench", VIP_GROUPS, None, jobs=8, multiget=100,
+                               cache=cache, sync=sync, logger=LOGGER)
+            # 1% of the vCards changed since the last run
+            for i in range(0, n, 100):
+                server.update_card(i)
+        def run():
+            requests = server.requests
+            if use_async:
+                books = asyncio.run(importer.get_books_async(server.url, "bench", "bench", VIP_GROUPS, None,
+                                                            jobs=jobs, multiget=multiget, cache=cache, logger=LOGGER))
+            else:
+                books = importer.get_books(server.url, "bench", "bench", VIP_GROUPS, None,
+                                           jobs=jobs, multiget=multiget, cache=cache, sync=sync, logger=LOGGER)
+            return sum(len(book.contactList) for book in books.phonebookList), server.requests - requests
+        return run
+    return prepare
+
+
+BENCHMARKS = {
+    "import-csv-outlook": _import("fritzbox.CSV", "csv-outlook"),
+    "import-csv-google":  _import("fritzbox.CSV", "csv-google"),
+    "import-csv-tellows": _import("fritzbox.CSV", "csv-tellows"),
+    "import-ldif":        _import("fritzbox.LDIF", "ldif"),
+    "import-vcf":         _import("fritzbox.VCF", "vcf"),
+    "import-vcf-photo":   _import("fritzbox.VCF", "vcf-photo", picture_path=True),
+    "import-vcf-fast":    _import("fritzbox.VCF", "vcf", fast_parser=True),
+    "import-vcf-jobs":    _import("fritzbox.VCF", "vcf", jobs=4),
+    "import-vcf-photo-fast": _import("fritzbox.VCF", "vcf-photo", picture_path=True, fast_parser=True),
+    "import-vcf-photo-jobs": _import("fritzbox.VCF", "vcf-photo", picture_path=True, fast_parser=True, photo_jobs=4),
+    "import-vcf-photo-cached": _import("fritzbox.VCF", "vcf-photo", picture_path=True, fast_parser=True, cached=True),
+    "import-vcf-dir":     _import("fritzbox.VCF", "vcf-dir", fast_parser=True),
+    "import-vcf-dir-jobs": _import("fritzbox.VCF", "vcf-dir", fast_parser=True, jobs=4),
+    "import-vcf-dir-cached": _import("fritzbox.VCF", "vcf-dir", fast_parser=True, cached=True),
+    "import-xml":         _import("fritzbox.XML", "xml"),
+    "normalize":          _normalize,
+    "main-number":        _main_number,
+    "merge":              _merge,
+    "write":              _write,
+    "carddav-get":        _carddav(),
+    "carddav-get-jobs":   _carddav(jobs=8),
+    "carddav-multiget":   _carddav(multiget=100),
+    "carddav-multiget-jobs": _carddav(jobs=4, multiget=100),
+    "carddav-async":      _carddav(jobs=8, use_async=True),
+    "carddav-cached":     _carddav(jobs=8, multiget=100, cached=True),
+    "carddav-sync":       _carddav(jobs=8, multiget=100, sync=True),
+}
+
+
+def _max_rss():
+    # kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+# runs in a fresh process, so peak memory is not influenced by other benchmarks
+def run_one(name, n, directory):
+    run = BENCHMARKS[name](directory, n)
+    rss_before = _max_rss()
+    start = time.perf_counter()
+    count = run()
+    seconds = time.perf_counter() - start
+    rss_after = _max_rss()
+    requests = None
+    if isinstance(count, tuple):
+        count, requests = count
+    result = {
+        "seconds": seconds,
+        "contacts": count,
+        "contacts_per_second": count / seconds if seconds > 0 else None,
+        "peak_rss_bytes": rss_after,
+        "peak_rss_growth_bytes": rss_after - rss_before,
+    }
+    if requests is not None:
+        result["requests"] = requests
+        result["requests_per_second"] = requests / seconds if seconds > 0 else None
+    return result
+
+
+def run_subprocess(name, size, directory):
+    cmd = [sys.executable, os.path.abspath(__file__), "--run-one", name, size, "--data-dir", directory,
+           "--carddav-latency", str(CARDDAV_LATENCY)]
+    proc = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    if proc.returncode != 0:
+        lines = proc.stderr.strip().splitlines()
+        return {"error": lines[-1] if lines else "exit code %d" % proc.returncode}
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+# returns list of regressions as text
+def compare(results, baseline, tolerance):
+    regressions = []
+    for key, base in baseline["results"].items():
+        result = results["results"].get(key)
+        if not result or "error" in result or "error" in base:
+            continue
+        if result["contacts_per_second"] < base["contacts_per_second"] * (1.0 - tolerance):
+            regressions.append("%s: throughput %.0f -> %.0f contacts/s" % (key, base["contacts_per_second"], result["contacts_per_second"]))
+        if result["peak_rss_growth_bytes"] > base["peak_rss_growth_bytes"] * (1.0 + tolerance) + 1024 * 1024:
+            regressions.append("%s: peak memory %.1f -> %.1f MB" % (key, base["peak_rss_growth_bytes"] / 1e6, result["peak_rss_growth_bytes"] / 1e6))
+    return regressions
+
+
+#
+# main
+#
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the phonebook importers and post processing")
+    parser.add_argument("--sizes", nargs="+", choices=list(SIZES.keys()), default=["1k"],
+        help="number of contacts")
+    parser.add_argument("--benchmarks", nargs="+", choices=list(BENCHMARKS.keys()), default=list(BENCHMARKS.keys()),
+        help="benchmarks to run, default all")
+    parser.add_argument("--data-dir", dest="data_dir",
+        help="directory for the generated phonebooks, kept between runs. Default is a temporary directory.")
+    parser.add_argument("--output",
+        help="save results as JSON")
+    parser.add_argument("--baseline",
+        help="compare against results saved with --output, exit code 1 on regressions")
+    parser.add_argument("--tolerance", type=float, default=0.1,
+        help="allowed relative regression, default 0.1")
+    parser.add_argument("--carddav-latency", dest="carddav_latency", type=float, default=CARDDAV_LATENCY,
+        help="seconds the local CardDAV server adds to each request, default %.3f" % CARDDAV_LATENCY)
+    parser.add_argument("--run-one", dest="run_one", nargs=2, metavar=("BENCHMARK", "SIZE"),
+        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.CRITICAL)
+    CARDDAV_LATENCY = args.carddav_latency
+
+    if args.run_one:
+        name, size = args.run_one
+        print(json.dumps(run_one(name, SIZES[size], args.data_dir)))
+        sys.exit(0)
+
+    tmpdir = None
+    data_dir = args.data_dir
+    if data_dir is None:
+        tmpdir = tempfile.TemporaryDirectory(prefix="fritzbox-benchmark-")
+        data_dir = tmpdir.name
+    elif not os.path.exists(data_dir):
+        os.makedirs(data_dir)
+
+    results = {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "results": {},
+    }
+    for size in args.sizes:
+        for name in args.benchmarks:
+            key = "%s/%s" % (name, size)
+            result = run_subprocess(name, size, data_dir)
+            results["results"][key] = result
+            if "error" in result:
+                print("%-28s skipped: %s" % (key, result["error"]))
+            else:
+                line = "%-28s %10.3fs %12.0f contacts/s %10.1f MB peak" % (
+                    key, result["seconds"], result["contacts_per_second"], result["peak_rss_growth_bytes"] / 1e6)
+                if "requests" in result:
+                    line += " %8d requests %10.0f requests/s" % (result["requests"], result["requests_per_second"])
+                print(line)
+    if tmpdir: tmpdir.cleanup()
+
+    if args.output:
+        with open(args.output, "w") as outfile:
+            json.dump(results, outfile, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, "r") as infile:
+            baseline = json.load(infile)
+        regressions = compare(results, baseline, args.tolerance)
+        for r in regressions:
+            print("regression: %s" % r)
+        if regressions:
+            sys.exit(1)
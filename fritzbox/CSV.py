@@ -16,17 +16,20 @@
 # Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
 #
 
+import io
 import csv
+import codecs
 import logging
 
 # fritzbox
 import fritzbox.phonebook
+import fritzbox.stats
 
 
 class FindEncodingDictReader:
     """
     A CSV reader which will iterate over lines in the CSV file "f",
-    which is encoded in the given encoding.
+    a text stream already decoded (encoding is kept for compatibility).
     """
     def __init__(self, f, delimiter=',', dialect=csv.excel, encoding="utf-8"):
         self.reader = csv.DictReader(f, delimiter=delimiter, dialect=dialect)
@@ -51,41 +54,90 @@ class FindEncodingDictReader:
         return self
 
 
+# bytes read from the start and from the end of the file to find encoding and delimiter
+SAMPLE_SIZE = 64 * 1024
+
+
+# decode error handler: bytes not used by windows-1252 (e.g. 0x81) are decoded as iso-8859-1
+def _latin1_errors(ex):
+  return ex.object[ex.start:ex.end].decode("iso-8859-1"), ex.end
+
+codecs.register_error("fritzbox-latin1", _latin1_errors)
+
+
+# returns (head, tail) of the binary file, tail is empty if head is the whole file
+def _read_sample(infile):
+  head = infile.read(SAMPLE_SIZE)
+  tail = b""
+  if len(head) == SAMPLE_SIZE:
+    end = infile.seek(0, io.SEEK_END)
+    # even offset, keeps UTF-16 code units aligned
+    start = max(SAMPLE_SIZE, end - SAMPLE_SIZE) & ~1
+    infile.seek(start)
+    tail = infile.read()
+  infile.seek(0)
+  return head, tail
+
+
+def _is_utf8(data, final):
+  try:
+    codecs.getincrementaldecoder("utf-8")().decode(data, final)
+    return True
+  except UnicodeDecodeError:
+    return False
+
+
+# returns the encoding of the sample as returned by _read_sample
+def detect_encoding(head, tail, logger: logging.Logger):
+  # byte order mark, UTF-32 first, its mark starts like the UTF-16 one
+  if head.startswith(codecs.BOM_UTF8):
+    encoding = "utf-8-sig"
+  elif head.startswith(codecs.BOM_UTF32_LE) or head.startswith(codecs.BOM_UTF32_BE):
+    encoding = "utf-32"
+  elif head.startswith(codecs.BOM_UTF16_LE) or head.startswith(codecs.BOM_UTF16_BE):
+    encoding = "utf-16"
+  # UTF-16 without mark: text is mostly ASCII, every second byte is NUL
+  elif head[1::2].count(0) > len(head) // 4 and head[0::2].count(0) == 0:
+    encoding = "utf-16-le"
+  elif head[0::2].count(0) > len(head) // 4 and head[1::2].count(0) == 0:
+    encoding = "utf-16-be"
+  # the tail can start within a character
+  elif _is_utf8(head, not tail) and _is_utf8(tail.lstrip(bytes(range(0x80, 0xc0))), True):
+    encoding = "utf-8"
+  else:
+    # windows-1252 with undefined bytes decoded as iso-8859-1 (see parse_csv_stream) is a superset of the
+    # printable iso-8859-1 characters: 0x80-0x9f are e.g. the euro sign instead of control characters
+    encoding = "windows-1252"
+  logger.debug("Correct encoding is %s" % encoding)
+  return encoding
+
+
+# returns the delimiter of the first line of the decoded sample
+def detect_delimiter(text, logger: logging.Logger):
+  line = (text.splitlines() or [""])[0]
+  semi_cnt = line.count(";")
+  comma_cnt = line.count(",")
+  delimiter = ","
+  if semi_cnt >  comma_cnt: delimiter = ";"
+  logger.debug("Correct delimiter is '%s'" % delimiter)
+  return delimiter
+
+
+def _decode_sample(head, encoding):
+  return codecs.getincrementaldecoder(encoding)(errors="replace").decode(head, False)
+
+
 def find_delimiter(filname, logger: logging.Logger):
-  with open(filname, 'r') as f:
-    line = f.readline()
-    semi_cnt = line.count(";")
-    comma_cnt = line.count(",")
-    delimiter = ","
-    if semi_cnt >  comma_cnt: delimiter = ";"
-    logger.debug("Correct delimiter is '%s'" % delimiter)
-    return delimiter
+  with open(filname, "rb") as infile:
+    head, tail = _read_sample(infile)
+  return detect_delimiter(_decode_sample(head, detect_encoding(head, tail, logger)), logger)
 
 
+# delimiter is not needed, kept for compatibility
 def find_encoding(filname, delimiter, logger: logging.Logger):
-  all_encoding = [
-    "utf-8", "iso-8859-1", "iso-8859-2", "iso-8859-15",
-    "iso-8859-3", "us-ascii", "windows-1250", "windows-1252",
-    "windows-1254", "ibm861"
-  ]
-  encoding_index = 0
-  csv_reader = None
-  while csv_reader == None:  
-    next_encoding = all_encoding[encoding_index]
-    logger.debug("Trying %s" % (next_encoding))
-    csv_file = open(filname, "rt")
-    csv_reader = FindEncodingDictReader(csv_file, delimiter=delimiter, encoding=next_encoding)
-    try:
-      for line in enumerate(csv_reader):
-        # Do nothing, just reading the whole file
-        encoding_index = encoding_index
-    except UnicodeDecodeError:
-      csv_reader = None
-      encoding_index = encoding_index + 1
-
-  logger.debug("Correct encoding is %s" % next_encoding)
-  csv_file.close()
-  return next_encoding
+  with open(filname, "rb") as infile:
+    head, tail = _read_sample(infile)
+  return detect_encoding(head, tail, logger)
 
 
 def getEntityPerson(fields):
@@ -115,7 +167,24 @@ def getEntityPerson(fields):
 
 
 def parse_csv(filename, delimiter, encoding, logger: logging.Logger):
-  csv_file = open(filename, "rt")
+  with open(filename, "rb") as infile:
+    return parse_csv_stream(infile, delimiter, encoding, logger)
+
+
+# stream: binary file, decoded with encoding while parsing
+# errors: decode error handler, default "fritzbox-latin1" for windows-1252, else strict
+def parse_csv_stream(stream, delimiter, encoding, logger: logging.Logger, errors=None):
+  if errors is None:
+    errors = "fritzbox-latin1" if codecs.lookup(encoding).name == "cp1252" else "strict"
+  csv_file = io.TextIOWrapper(stream, encoding=encoding, errors=errors, newline="")
+  try:
+    return _parse_csv_rows(csv_file, delimiter, encoding, logger)
+  finally:
+    # the caller closes the stream
+    csv_file.detach()
+
+
+def _parse_csv_rows(csv_file, delimiter, encoding, logger: logging.Logger):
   csv_reader = FindEncodingDictReader(csv_file, delimiter=delimiter, encoding=encoding)
 
   phoneBook = fritzbox.phonebook.Phonebook()
@@ -171,16 +240,29 @@ def parse_csv(filename, delimiter, encoding, logger: logging.Logger):
       contact = fritzbox.phonebook.Contact(0, person, telephony)
       phoneBook.addContact(contact)
 
-  csv_file.close()
-  return phoneBook  
+  return phoneBook
 
 
 class Import(object):
   def get_books(self, filename, vipGroups, logger: logging.Logger=logging.getLogger()):
-    delimiter = find_delimiter(filename, logger)
-    encoding = find_encoding(filename, delimiter, logger)
-    book = parse_csv(filename, delimiter, encoding, logger)
-    books = fritzbox.phonebook.Phonebooks()
-    books.addPhonebook(book)
+    stats = fritzbox.stats.get()
+    with stats.timer("import"):
+      # the file is read once, encoding and delimiter are detected from a sample
+      with open(filename, "rb") as infile:
+        head, tail = _read_sample(infile)
+        encoding = detect_encoding(head, tail, logger)
+        delimiter = detect_delimiter(_decode_sample(head, encoding), logger)
+        try:
+          book = parse_csv_stream(infile, delimiter, encoding, logger)
+        except UnicodeDecodeError as ex:
+          if encoding != "utf-8":
+            raise
+          # not UTF-8 between head and tail of the sample, most likely a windows export
+          logger.warning("Not UTF-8 (%s), reading as windows-1252" % ex)
+          infile.seek(0)
+          book = parse_csv_stream(infile, delimiter, "windows-1252", logger)
+      books = fritzbox.phonebook.Phonebooks()
+      books.addPhonebook(book)
+    stats.countBooks(books)
     return books
 
@@ -16,15 +16,35 @@
 # Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
 #
 
+import os
+import pickle
+import asyncio
 import logging
+import threading
 import requests
+import concurrent.futures
 import urllib.parse
+import xml.sax.saxutils
 import xml.etree.ElementTree as ET
 import vobject
 
 # fritzbox
 import fritzbox.phonebook
 import fritzbox.VCF
+import fritzbox.fonpix
+import fritzbox.stats
+
+
+NS_DAV = "{DAV:}"
+NS_CARDDAV = "{urn:ietf:params:xml:ns:carddav}"
+VCARD_CONTENT_TYPES = ["text/vcard", "text/vcard; charset=utf-8", "text/x-vcard", "text/x-vcard; charset=utf-8"]
+PROPFIND_HEADERS = {"Depth": "1", "Content-Type": "application/xml; charset=utf-8"}
+# addressbook-multiget is only defined with Depth 0 (RFC 6352 8.7)
+MULTIGET_HEADERS = {"Depth": "0", "Content-Type": "application/xml; charset=utf-8"}
+PROPFIND_BODY = (b'<?xml version="1.0" encoding="utf-8"?>\n'
+                 b'<d:propfind xmlns:d="DAV:"><d:prop><d:getetag/><d:getcontenttype/></d:prop></d:propfind>')
+# address books downloaded at the same time by Import.get_books_multi() with discover
+DISCOVER_BOOKS_PARALLEL = 8
 
 
 class Import(object):
@@ -35,78 +55,604 @@ class Import(object):
       raise requests.exceptions.HTTPError(msg)
 
 
+  # returns the multistatus response as stream, with getetag and getcontenttype of each member
   def _get_xml(self, session, url_dav, settings, logger: logging.Logger):
-    response = session.request('PROPFIND', url_dav, headers=[], **settings)
+    response = session.request('PROPFIND', url_dav, headers=PROPFIND_HEADERS, data=PROPFIND_BODY, stream=True, **settings)
     self._raise_for_status_code(response)
-    #logger.debug("Response: %s" % response.content)
     if response.headers['DAV'].count('addressbook') == 0:
         raise Exception("URL is not a CardDAV resource")
-    return response.content
+    response.raw.decode_content = True
+    return response.raw
+
 
+  # yields the <response> and <sync-token> elements of a multistatus while it is parsed,
+  # the elements are freed after use
+  def _iter_multistatus(self, source):
+    root = None
+    for event, elem in ET.iterparse(source, events=("start", "end")):
+      if root is None:
+        root = elem
+      elif event == "end" and elem.tag in [NS_DAV + "response", NS_DAV + "sync-token"]:
+        yield elem
+        root.clear()
 
+
+  # xml: stream or file name of the PROPFIND multistatus response
+  # returns {href: etag} of all vCards
   def _process_xml(self, xml, logger: logging.Logger):
-    namespace = "{DAV:}"
-    root = ET.XML(xml)
-    #logger.debug("root: %s" % ET.tostring(root, "utf-8"))
     hrefs = dict()
-    for response in root:
-      if response.tag != namespace + "response":
-        continue
-      #if len(hrefs) == 10: break
-      href = ""
-      etag = ""
-      found = False
-      for child in response:
-        if child.tag == namespace + "href":
-          href = child.text
-        for refprop in child:
-          for props in refprop:
-            if props.tag == namespace + "getcontenttype":
-              if (props.text == "text/vcard" or props.text == "text/vcard; charset=utf-8" or
-                  props.text == "text/x-vcard" or props.text == "text/x-vcard; charset=utf-8"):
-                found = True
-            elif props.tag == namespace + "getetag":
-                etag = props.text
-          if found:
-            hrefs[href] = etag
-            break
+    for response in self._iter_multistatus(xml):
+      self._process_response(response, hrefs)
     return hrefs
 
 
-  def _get_vcard(self, session, url_vcard, settings, logger: logging.Logger):
+  # adds href and etag of a PROPFIND <response> element to hrefs if it is a vCard
+  def _process_response(self, response, hrefs):
+    if response.tag != NS_DAV + "response":
+      return
+    href = response.findtext(NS_DAV + "href")
+    for prop in response.iter(NS_DAV + "prop"):
+      if prop.findtext(NS_DAV + "getcontenttype") in VCARD_CONTENT_TYPES:
+        hrefs[href] = prop.findtext(NS_DAV + "getetag") or ""
+        break
+
+
+  def _get_vcard_text(self, session, url_vcard, settings, logger: logging.Logger):
     logger.debug("_get_vcard(%s)" % url_vcard)
     response = session.get(url_vcard, headers=[], **settings)
     self._raise_for_status_code(response)
     #logger.debug("Response: %s" % response.content)
-    ret = vobject.readOne(response.content.decode())
+    return response.content.decode()
+
+
+  def _get_vcard(self, session, url_vcard, settings, logger: logging.Logger):
+    return vobject.readOne(self._get_vcard_text(session, url_vcard, settings, logger))
+
+
+  # returns {href: vcard text} for one batch of hrefs, fetched with a addressbook-multiget REPORT
+  def _multiget(self, session, url_dav, hrefs, settings, logger: logging.Logger):
+    logger.debug("_multiget(%s, %d hrefs)" % (url_dav, len(hrefs)))
+    response = session.request('REPORT', url_dav, headers=MULTIGET_HEADERS, data=self._multiget_body(hrefs),
+                               stream=True, **settings)
+    try:
+      self._raise_for_status_code(response)
+
+      # parse multistatus while it is received
+      texts = {}
+      response.raw.decode_content = True
+      for elem in self._iter_multistatus(response.raw):
+        self._process_multiget_response(elem, texts)
+    finally:
+      # returns the pooled connection, also on errors
+      response.close()
+    return self._multiget_result(hrefs, texts, logger)
+
+
+  def _multiget_body(self, hrefs):
+    body = '<?xml version="1.0" encoding="utf-8"?>\n'
+    body += '<card:addressbook-multiget xmlns:d="DAV:" xmlns:card="urn:ietf:params:xml:ns:carddav">'
+    body += '<d:prop><d:getetag/><card:address-data/></d:prop>'
+    for href in hrefs:
+      body += '<d:href>%s</d:href>' % xml.sax.saxutils.escape(href)
+    body += '</card:addressbook-multiget>'
+    return body.encode("utf-8")
+
+
+  # adds the vCard text of a multiget <response> element to texts
+  def _process_multiget_response(self, response, texts):
+    href = response.findtext(NS_DAV + "href")
+    data = response.findtext(".//" + NS_CARDDAV + "address-data")
+    if href and data:
+      texts[urllib.parse.unquote(href)] = data
+
+
+  # returns {href: vcard text} of the requested hrefs, missing vCards are logged
+  def _multiget_result(self, hrefs, texts, logger: logging.Logger):
+    ret = {}
+    for href in hrefs:
+      text = texts.get(urllib.parse.unquote(href))
+      if text is None:
+        logger.error("Failed to get vCard %s: missing in multiget response" % href)
+      else:
+        ret[href] = text
     return ret
 
 
-  def get_books(self, url, username, password, vipGroups, picture_path,
-                conn_auth="basic", conn_verify=True, logger: logging.Logger=logging.getLogger()):
-    logger.debug("get_books(%s)" % url)
+  # returns {href: vcard text} in the order of hrefs, failed downloads are logged and skipped
+  # multiget: number of vCards per addressbook-multiget REPORT, 0 to get each vCard on its own
+  def _get_vcard_texts(self, session, url_dav, url_base, hrefs, settings, jobs, multiget, logger: logging.Logger):
+    def get_vcard(href):
+      try:
+        return {href: self._get_vcard_text(session, url_base + href, settings, logger)}
+      except Exception as ex:
+        logger.error("Failed to get vCard %s: %s" % (href, ex))
+        return {}
 
-    # url base
-    url_split = urllib.parse.urlparse(url)
-    url_base = url_split.scheme + '://' + url_split.netloc
+    def get_batch(batch):
+      try:
+        return self._multiget(session, url_dav, batch, settings, logger)
+      except Exception as ex:
+        logger.warning("addressbook-multiget failed, getting vCards one by one: %s" % ex)
+        ret = {}
+        for href in batch:
+          ret.update(get_vcard(href))
+        return ret
 
-    # authentification
+    if multiget > 0:
+      func = get_batch
+      tasks = [hrefs[i:i + multiget] for i in range(0, len(hrefs), multiget)]
+    else:
+      func = get_vcard
+      tasks = hrefs
+    if jobs > 1:
+      with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        results = list(executor.map(func, tasks))
+    else:
+      results = [func(task) for task in tasks]
+
+    texts = {}
+    for result in results:
+      texts.update(result)
+    failed = len(hrefs) - len(texts)
+    if failed:
+      fritzbox.stats.get().count("cards_failed", failed)
+    return texts
+
+
+  # returns ({href: etag, None if deleted}, new sync token) of the changes since token (RFC 6578)
+  def _sync_collection(self, session, url_dav, token, settings, logger: logging.Logger):
+    logger.debug("_sync_collection(%s, %s)" % (url_dav, token))
+    changes = {}
+    while True:
+      body = '<?xml version="1.0" encoding="utf-8"?>\n'
+      body += '<d:sync-collection xmlns:d="DAV:">'
+      body += '<d:sync-token>%s</d:sync-token><d:sync-level>1</d:sync-level>' % xml.sax.saxutils.escape(token or "")
+      body += '<d:prop><d:getetag/><d:getcontenttype/></d:prop>'
+      body += '</d:sync-collection>'
+      headers = {"Content-Type": "application/xml; charset=utf-8"}
+      response = session.request('REPORT', url_dav, headers=headers, data=body.encode("utf-8"), stream=True, **settings)
+      self._raise_for_status_code(response)
+
+      truncated = False
+      new_token = None
+      response.raw.decode_content = True
+      for elem in self._iter_multistatus(response.raw):
+        if elem.tag == NS_DAV + "response":
+          href = elem.findtext(NS_DAV + "href")
+          status = elem.findtext(NS_DAV + "status") or ""
+          if " 404 " in status:
+            changes[href] = None
+          elif " 507 " in status:
+            # more changes than the server returns at once
+            truncated = True
+          else:
+            contenttype = elem.findtext(".//" + NS_DAV + "getcontenttype")
+            if contenttype is None or contenttype in VCARD_CONTENT_TYPES:
+              changes[href] = elem.findtext(".//" + NS_DAV + "getetag") or ""
+        elif elem.tag == NS_DAV + "sync-token":
+          new_token = elem.text
+      response.close()
+      if not truncated or not new_token or new_token == token:
+        return changes, new_token
+      token = new_token
+
+
+  # returns ({href: etag} of the address book built from the cache and the changes since
+  # the last sync, new sync token), (None, None) if the server does not support sync-collection
+  # or the token is invalid. The new token is saved by _build_books once all cards are cached.
+  def _sync_hrefs(self, session, url_dav, cache, settings, logger: logging.Logger):
+    token = cache.getSyncToken(url_dav)
+    try:
+      changes, new_token = self._sync_collection(session, url_dav, token, settings, logger)
+    except requests.exceptions.HTTPError as ex:
+      logger.warning("sync-collection failed, doing a full sync: %s" % ex)
+      cache.setSyncToken(url_dav, None)
+      return None, None
+    hrefs = cache.getETags(url_dav) if token else {}
+    for href, etag in changes.items():
+      if etag is None: hrefs.pop(href, None)
+      else: hrefs[href] = etag
+    fritzbox.stats.get().count("cards_changed", len(changes))
+    return hrefs, new_token
+
+
+  # returns the contact of the vCard, None if it has no phone numbers
+  def _convert(self, vcf, text, vipGroups, picture_path, logger: logging.Logger):
+    card = vobject.readOne(text)
+    books = vcf.get_books_by_cards([card], vipGroups, picture_path, logger)
+    contacts = books.phonebookList[0].contactList
+    return contacts[0] if contacts else None
+
+
+  # returns ({href: (vcard text, contact)} of the vCards with unchanged ETag, [hrefs to download])
+  def _split_cached(self, url, hrefs, cache):
+    cached = {}
+    missing = []
+    for href, etag in hrefs.items():
+      entry = cache.get(url, href, etag) if cache else None
+      if entry is None: missing.append(href)
+      else: cached[href] = entry
+    fritzbox.stats.get().count("cards_cached", len(cached))
+    return cached, missing
+
+
+  # converts the cached and fetched vCards into contacts, in the order of hrefs, and updates the cache
+  # sync_token: token of the changes in hrefs, saved if all cards are cached
+  def _build_books(self, url, hrefs, cached, fetched, cache, vipGroups, picture_path, logger: logging.Logger,
+                   sync_token=None):
+    books, cards = self._convert_books(url, hrefs, cached, fetched, cache, vipGroups, picture_path, logger)
+    self._update_cache(url, hrefs, cards, cache, vipGroups, picture_path, sync_token)
+    return books
+
+  # converts the cached and fetched vCards into contacts, in the order of hrefs, the cache is not changed
+  # cached contacts are reused if converted with the same settings
+  # returns (books, {href: (etag, vcard text, contact)})
+  def _convert_books(self, url, hrefs, cached, fetched, cache, vipGroups, picture_path, logger: logging.Logger):
+    stats = fritzbox.stats.get()
+    convert_settings = [sorted(vipGroups), picture_path]
+    reuse = cache is not None and cache.getSettings(url) == convert_settings
+    vcf = fritzbox.VCF.Import()
+    book = fritzbox.phonebook.Phonebook()
+    cards = {}
+    for href, etag in hrefs.items(): # order of the server response
+      if href in cached:
+        text, contact = cached[href]
+        # a removed photo is created again by converting the vCard
+        if reuse and fritzbox.fonpix.photoExists(picture_path, contact):
+          cards[href] = (etag, text, contact)
+          if contact: book.addContact(contact)
+          continue
+      elif href in fetched:
+        text = fetched[href]
+      else:
+        continue
+      try:
+        contact = self._convert(vcf, text, vipGroups, picture_path, logger)
+      except Exception as ex:
+        logger.error("Failed to parse vCard %s: %s" % (href, ex))
+        stats.count("cards_failed")
+        continue
+      cards[href] = (etag, text, contact)
+      if contact: book.addContact(contact)
+    stats.count("cards", len(cards))
+
+    books = fritzbox.phonebook.Phonebooks()
+    books.addPhonebook(book)
+    return books, cards
+
+  # cards: as returned by _convert_books
+  def _update_cache(self, url, hrefs, cards, cache, vipGroups, picture_path, sync_token=None):
+    if cache is None:
+      return
+    # cards failing now or without ETag are not cached, the next sync must report them again
+    if sync_token is not None and all(cards.get(href, ("",))[0] for href in hrefs):
+      cache.setSyncToken(url, sync_token)
+    cache.update(url, cards, [sorted(vipGroups), picture_path])
+    cache.save()
+
+
+  def _settings(self, username, password, conn_auth, conn_verify):
     settings = {"verify": conn_verify}
     if conn_auth == "basic":
       settings["auth"] = (username, password)
     elif conn_auth == "digest":
       from requests.auth import HTTPDigestAuth
       settings["auth"] = HTTPDigestAuth(username, password)
+    return settings
+
 
+  # returns a session keeping up to connections pooled connections per host
+  def _session(self, connections=1):
     session = requests.session()
-    xml = self._get_xml(session, url, settings, logger)
-    hrefs = self._process_xml(xml, logger)
+    if connections > 1:
+      adapter = requests.adapters.HTTPAdapter(pool_maxsize=connections)
+      session.mount("http://", adapter)
+      session.mount("https://", adapter)
+    return session
 
-    # convert into vcard objects
-    cards = []
-    for href in hrefs.keys():
-      cards.append(self._get_vcard(session, url_base + href, settings, logger))
 
-    vcf = fritzbox.VCF.Import()
-    books = vcf.get_books_by_cards(cards, vipGroups, picture_path, logger)
+  # returns the <response> elements of a small PROPFIND, e.g. for discovery
+  def _propfind(self, session, url, depth, props, settings):
+    body = '<?xml version="1.0" encoding="utf-8"?>\n'
+    body += '<d:propfind xmlns:d="DAV:" xmlns:card="urn:ietf:params:xml:ns:carddav"><d:prop>%s</d:prop></d:propfind>' % props
+    headers = {"Depth": depth, "Content-Type": "application/xml; charset=utf-8"}
+    response = session.request('PROPFIND', url, headers=headers, data=body.encode("utf-8"), **settings)
+    self._raise_for_status_code(response)
+    return ET.XML(response.content).findall(NS_DAV + "response")
+
+
+  # returns the URLs of all address books found from url: an address book, the principal,
+  # any URL knowing the current-user-principal (RFC 5397) or the addressbook-home-set (RFC 6352)
+  def discover(self, url, username, password, conn_auth="basic", conn_verify=True, session=None,
+               logger: logging.Logger=logging.getLogger()):
+    logger.debug("discover(%s)" % url)
+    settings = self._settings(username, password, conn_auth, conn_verify)
+    if session is None:
+      session = self._session()
+
+    def find_href(responses, prop):
+      for response in responses:
+        href = response.findtext(".//" + prop + "/" + NS_DAV + "href")
+        if href: return urllib.parse.urljoin(url, href.strip())
+      return None
+
+    props = "<d:resourcetype/><d:current-user-principal/><card:addressbook-home-set/>"
+    responses = self._propfind(session, url, "0", props, settings)
+    if any(r.find(".//" + NS_DAV + "resourcetype/" + NS_CARDDAV + "addressbook") is not None for r in responses):
+      return [url]
+    home = find_href(responses, NS_CARDDAV + "addressbook-home-set")
+    principal = find_href(responses, NS_DAV + "current-user-principal")
+    if home is None and principal is not None:
+      logger.debug("principal: %s" % principal)
+      responses = self._propfind(session, principal, "0", "<card:addressbook-home-set/>", settings)
+      home = find_href(responses, NS_CARDDAV + "addressbook-home-set")
+    if home is None:
+      # e.g. the collection with the address books
+      home = url
+    logger.debug("addressbook-home-set: %s" % home)
+
+    urls = []
+    for response in self._propfind(session, home, "1", "<d:resourcetype/>", settings):
+      if response.find(".//" + NS_DAV + "resourcetype/" + NS_CARDDAV + "addressbook") is not None:
+        urls.append(urllib.parse.urljoin(home, response.findtext(NS_DAV + "href").strip()))
+    return urls
+
+
+  # jobs: number of parallel downloads
+  # multiget: number of vCards fetched per addressbook-multiget REPORT, 0 to get each vCard on its own
+  # cache: class VCardCache, only vCards with a changed ETag are downloaded and converted
+  # sync: only ask the server for the changes since the last sync (RFC 6578 sync-collection), needs cache
+  # session: requests session to reuse its pooled connections, default a new one
+  def get_books(self, url, username, password, vipGroups, picture_path,
+                conn_auth="basic", conn_verify=True, jobs=1, multiget=0, cache=None, sync=False, session=None,
+                logger: logging.Logger=logging.getLogger()):
+    logger.debug("get_books(%s)" % url)
+    if sync and cache is None:
+      raise ValueError("sync needs a cache to keep the sync-token and the vCards")
+
+    # url base
+    url_split = urllib.parse.urlparse(url)
+    url_base = url_split.scheme + '://' + url_split.netloc
+
+    # authentification
+    settings = self._settings(username, password, conn_auth, conn_verify)
+
+    stats = fritzbox.stats.get()
+    with stats.timer("import"):
+      if session is None:
+        # one pooled connection per download thread
+        session = self._session(jobs)
+      with stats.timer("download"):
+        hrefs = None
+        sync_token = None
+        if sync:
+          hrefs, sync_token = self._sync_hrefs(session, url, cache, settings, logger)
+        if hrefs is None:
+          xml = self._get_xml(session, url, settings, logger)
+          hrefs = self._process_xml(xml, logger)
+        cached, missing = self._split_cached(url, hrefs, cache)
+        fetched = self._get_vcard_texts(session, url, url_base, missing, settings, jobs, multiget, logger)
+      books = self._build_books(url, hrefs, cached, fetched, cache, vipGroups, picture_path, logger, sync_token)
+    stats.countBooks(books)
     return books
+
+
+  # downloads several address books concurrently over one shared session
+  # urls: address book URLs, or with discover principal URLs to find the address books of
+  # returns class Phonebooks with one phonebook per address book, in the order of urls
+  def get_books_multi(self, urls, username, password, vipGroups, picture_path,
+                      conn_auth="basic", conn_verify=True, jobs=1, multiget=0, cache=None, sync=False,
+                      discover=False, logger: logging.Logger=logging.getLogger()):
+    # one pooled connection per download thread of each book, the number of books found by
+    # discover is not known yet: the pool is sized for the books downloaded at the same time
+    parallel = DISCOVER_BOOKS_PARALLEL if discover else max(len(urls), 1)
+    session = self._session(max(jobs, 1) * parallel)
+    try:
+      if discover:
+        found = []
+        for url in urls:
+          for book_url in self.discover(url, username, password, conn_auth, conn_verify, session, logger):
+            if book_url not in found:
+              logger.info("found address book %s" % book_url)
+              found.append(book_url)
+        urls = found
+
+      def get_books(url):
+        return self.get_books(url, username, password, vipGroups, picture_path, conn_auth, conn_verify,
+                              jobs, multiget, cache, sync, session, logger)
+      books = fritzbox.phonebook.Phonebooks()
+      if len(urls) > 1:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(len(urls), parallel)) as executor:
+          for tmp in executor.map(get_books, urls):
+            books.addPhonebooks(tmp)
+      else:
+        for url in urls:
+          books.addPhonebooks(get_books(url))
+      return books
+    finally:
+      session.close()
+
+
+  #
+  # asyncio
+  #
+
+  async def _araise_for_status_code(self, resp):
+    if 400 <= resp.status < 600:
+      msg  = "Error code: " + str(resp.status) + "\n"
+      msg += await resp.text()
+      raise requests.exceptions.HTTPError(msg)
+
+
+  # yields the <response> elements of a multistatus while it is received, the elements are freed after use
+  async def _aiter_multistatus(self, resp):
+    parser = ET.XMLPullParser(events=("start", "end"))
+    root = None
+    async for data in resp.content.iter_any():
+      parser.feed(data)
+      for event, elem in parser.read_events():
+        if root is None:
+          root = elem
+        elif event == "end" and elem.tag == NS_DAV + "response":
+          yield elem
+          root.clear()
+    parser.close()
+
+
+  async def _aget_hrefs(self, session, url_dav, logger: logging.Logger):
+    logger.debug("_aget_hrefs(%s)" % url_dav)
+    async with session.request('PROPFIND', url_dav, headers=PROPFIND_HEADERS, data=PROPFIND_BODY) as resp:
+      await self._araise_for_status_code(resp)
+      if resp.headers.get('DAV', '').count('addressbook') == 0:
+        raise Exception("URL is not a CardDAV resource")
+      hrefs = dict()
+      async for response in self._aiter_multistatus(resp):
+        self._process_response(response, hrefs)
+    return hrefs
+
+
+  async def _aget_vcard_text(self, session, url_vcard, logger: logging.Logger):
+    logger.debug("_aget_vcard_text(%s)" % url_vcard)
+    async with session.get(url_vcard) as resp:
+      await self._araise_for_status_code(resp)
+      return await resp.text()
+
+
+  async def _amultiget(self, session, url_dav, hrefs, logger: logging.Logger):
+    logger.debug("_amultiget(%s, %d hrefs)" % (url_dav, len(hrefs)))
+    async with session.request('REPORT', url_dav, headers=MULTIGET_HEADERS, data=self._multiget_body(hrefs)) as resp:
+      await self._araise_for_status_code(resp)
+      texts = {}
+      async for response in self._aiter_multistatus(resp):
+        self._process_multiget_response(response, texts)
+    return self._multiget_result(hrefs, texts, logger)
+
+
+  # async counterpart of _get_vcard_texts, at most jobs requests are running at the same time
+  async def _aget_vcard_texts(self, session, url_dav, url_base, hrefs, jobs, multiget, logger: logging.Logger):
+    semaphore = asyncio.Semaphore(max(jobs, 1))
+
+    async def get_vcard(href):
+      try:
+        async with semaphore:
+          return {href: await self._aget_vcard_text(session, url_base + href, logger)}
+      except Exception as ex:
+        logger.error("Failed to get vCard %s: %s" % (href, ex))
+        return {}
+
+    async def get_batch(batch):
+      try:
+        async with semaphore:
+          return await self._amultiget(session, url_dav, batch, logger)
+      except Exception as ex:
+        logger.warning("addressbook-multiget failed, getting vCards one by one: %s" % ex)
+        ret = {}
+        for result in await asyncio.gather(*[get_vcard(href) for href in batch]):
+          ret.update(result)
+        return ret
+
+    if multiget > 0:
+      tasks = [get_batch(hrefs[i:i + multiget]) for i in range(0, len(hrefs), multiget)]
+    else:
+      tasks = [get_vcard(href) for href in hrefs]
+    # cancelling the caller cancels all pending downloads
+    results = await asyncio.gather(*tasks)
+
+    texts = {}
+    for result in results:
+      texts.update(result)
+    failed = len(hrefs) - len(texts)
+    if failed:
+      fritzbox.stats.get().count("cards_failed", failed)
+    return texts
+
+
+  # async counterpart of get_books based on aiohttp, without sync-collection
+  # the vCards are converted and the cache is updated and saved in the default executor of the event loop:
+  # when cancelled during the conversion the cache is not updated, a started update is finished
+  async def get_books_async(self, url, username, password, vipGroups, picture_path,
+                            conn_auth="basic", conn_verify=True, jobs=1, multiget=0, cache=None,
+                            logger: logging.Logger=logging.getLogger()):
+    import aiohttp
+    logger.debug("get_books_async(%s)" % url)
+
+    # url base
+    url_split = urllib.parse.urlparse(url)
+    url_base = url_split.scheme + '://' + url_split.netloc
+
+    # authentification
+    settings = {}
+    if conn_auth == "basic":
+      settings["auth"] = aiohttp.BasicAuth(username, password)
+    elif conn_auth == "digest":
+      settings["middlewares"] = (aiohttp.DigestAuthMiddleware(username, password),)
+
+    stats = fritzbox.stats.get()
+    with stats.timer("import"):
+      connector = aiohttp.TCPConnector(limit=max(jobs, 1), ssl=None if conn_verify else False)
+      async with aiohttp.ClientSession(connector=connector, **settings) as session:
+        with stats.timer("download"):
+          hrefs = await self._aget_hrefs(session, url, logger)
+          cached, missing = self._split_cached(url, hrefs, cache)
+          fetched = await self._aget_vcard_texts(session, url, url_base, missing, jobs, multiget, logger)
+      loop = asyncio.get_running_loop()
+      books, cards = await loop.run_in_executor(None, self._convert_books, url, hrefs, cached, fetched, cache,
+                                                vipGroups, picture_path, logger)
+      await asyncio.shield(loop.run_in_executor(None, self._update_cache, url, hrefs, cards, cache,
+                                                vipGroups, picture_path))
+    stats.countBooks(books)
+    return books
+
+
+# Downloaded vCards with their ETag and converted contact, persisted in a local file.
+# Per address book URL: {"sync-token": token, "settings": conversion settings,
+#                        "cards": {href: (etag, vcard text, contact or None)}}
+class VCardCache(object):
+  def __init__(self, filename):
+    self.filename = filename
+    self.books = {}
+    # address books can be synced from several threads
+    self._lock = threading.Lock()
+    if os.path.exists(filename):
+      with open(filename, "rb") as infile:
+        self.books = pickle.load(infile)
+
+  # returns (vcard text, contact) if cached with the same ETag, else None
+  def get(self, url, href, etag):
+    if not etag:
+      return None
+    entry = self.books.get(url, {}).get("cards", {}).get(href)
+    if entry is None or entry[0] != etag:
+      return None
+    return entry[1], entry[2]
+
+  # returns {href: etag} of all cached vCards
+  def getETags(self, url):
+    return {href: entry[0] for href, entry in self.books.get(url, {}).get("cards", {}).items()}
+
+  def getSyncToken(self, url):
+    return self.books.get(url, {}).get("sync-token")
+
+  def setSyncToken(self, url, token):
+    with self._lock:
+      self.books.setdefault(url, {})["sync-token"] = token
+
+  def getSettings(self, url):
+    return self.books.get(url, {}).get("settings")
+
+  # cards: {href: (etag, vcard text, contact)}, all cards of the address book, others are evicted
+  def update(self, url, cards, settings):
+    with self._lock:
+      book = self.books.setdefault(url, {})
+      book["settings"] = settings
+      book["cards"] = {href: entry for href, entry in cards.items() if entry[0]}
+
+  def save(self):
+    dirname = os.path.dirname(self.filename)
+    if dirname and not os.path.exists(dirname):
+      os.makedirs(dirname, exist_ok=True)
+    tmp = self.filename + ".tmp"
+    with self._lock:
+      with open(tmp, "wb") as outfile:
+        pickle.dump(self.books, outfile, pickle.HIGHEST_PROTOCOL)
+      os.replace(tmp, self.filename)
@@ -21,6 +21,7 @@ from ldif import LDIFParser
 
 # fritzbox
 import fritzbox.phonebook
+import fritzbox.stats
 
 
 class ParseGroups(LDIFParser):
@@ -121,16 +122,19 @@ class ParsePersons(LDIFParser):
 
 class Import(object):
   def get_books(self, filename, vipGroupArray, logger: logging.Logger=logging.getLogger()):
-    # parse groups
-    parser = ParseGroups(open(filename, "rb"), vipGroupArray, logger)
-    parser.parse()
-    vipGroupDict = parser.vipGroupDict
-
-    # parse persons
-    parser = ParsePersons(open(filename, "rb"), vipGroupDict, logger)
-    parser.parse()
-    phoneBook = parser.phoneBook
-    
-    books = fritzbox.phonebook.Phonebooks()
-    books.addPhonebook(phoneBook)
+    stats = fritzbox.stats.get()
+    with stats.timer("import"):
+      # parse groups
+      parser = ParseGroups(open(filename, "rb"), vipGroupArray, logger)
+      parser.parse()
+      vipGroupDict = parser.vipGroupDict
+
+      # parse persons
+      parser = ParsePersons(open(filename, "rb"), vipGroupDict, logger)
+      parser.parse()
+      phoneBook = parser.phoneBook
+
+      books = fritzbox.phonebook.Phonebooks()
+      books.addPhonebook(phoneBook)
+    stats.countBooks(books)
     return books
@@ -18,30 +18,212 @@
 # Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
 #
 
+import io
 import os
 import re
-import codecs
+import mmap
+import pickle
 import vobject
 import logging
+import collections
+import concurrent.futures
 
 from PIL import Image
 from PIL import ImageOps
 
 # fritzbox
+import fritzbox.fonpix
 import fritzbox.phonebook
+import fritzbox.stats
+import fritzbox.vcard
 
 
 class Import(object):
-  def get_books(self, filename, vipGroups, picture_path, logger: logging.Logger=logging.getLogger()):
-    cards = []
-    with codecs.open(filename, "r", "utf-8") as infile:
-      data = infile.read()
-      for card in vobject.readComponents(data):
-        cards.append(card)
-    return self.get_books_by_cards(cards, vipGroups, picture_path, logger)
+  # fast_parser: parse only the needed properties with fritzbox.vcard, falls back to vobject per card
+  # photo_jobs: number of processes resizing and saving photos
+  # jobs: number of processes parsing and converting parts of the file, see _get_ranges
+  def get_books(self, filename, vipGroups, picture_path, fast_parser=False, photo_jobs=1, jobs=1,
+                logger: logging.Logger=logging.getLogger()):
+    stats = fritzbox.stats.get()
+    with stats.timer("import"):
+      ranges = self._get_ranges(filename, jobs) if jobs > 1 else []
+      if len(ranges) > 1:
+        books = self._get_books_parallel(filename, ranges, vipGroups, picture_path, fast_parser, jobs, logger)
+      else:
+        readOne = fritzbox.vcard.readOne if fast_parser else vobject.readOne
+        # one card at a time is read, parsed and converted
+        with open(filename, "r", encoding="utf-8-sig", newline="") as infile:
+          cards = (readOne(text) for text in self._iter_card_texts(infile))
+          books = self.get_books_by_cards(cards, vipGroups, picture_path, logger, photo_jobs)
+    stats.countBooks(books)
+    return books
+
+
+  # loads a directory tree of vCard files with one or more cards each (e.g. vdirsyncer),
+  # the contacts are in the order of the file names
+  # jobs: number of threads scanning the directory and processes converting the files
+  # cache: class VCardFileCache, only files with changed mtime or size are converted
+  def get_books_dir(self, path, vipGroups, picture_path, fast_parser=False, jobs=1, cache=None,
+                    logger: logging.Logger=logging.getLogger()):
+    stats = fritzbox.stats.get()
+    with stats.timer("import"):
+      files = self._scan_dir(path, jobs)
+      convert_settings = [sorted(vipGroups), picture_path]
+      reuse = cache is not None and cache.getSettings() == convert_settings
+      converted = {}
+      missing = []
+      for name, mtime, size in files:
+        contacts = cache.get(name, mtime, size) if reuse else None
+        # a removed photo is created again by converting the file
+        if contacts is not None and not all(fritzbox.fonpix.photoExists(picture_path, c) for c in contacts):
+          contacts = None
+        if contacts is None: missing.append(name)
+        else: converted[name] = contacts
+      stats.count("files_cached", len(converted))
+      converted.update(self._convert_files(path, missing, vipGroups, picture_path, fast_parser, jobs, logger))
+
+      book = fritzbox.phonebook.Phonebook()
+      entries = {}
+      for name, mtime, size in files:
+        contacts = converted.get(name)
+        if contacts is None:
+          # failed, converted again next time
+          continue
+        entries[name] = (mtime, size, contacts)
+        for contact in contacts:
+          book.addContact(contact)
+      stats.count("files", len(files))
+      if cache is not None:
+        cache.update(entries, convert_settings)
+        cache.save()
+
+    books = fritzbox.phonebook.Phonebooks()
+    books.addPhonebook(book)
+    stats.countBooks(books)
+    return books
+
+  # returns sorted list of (name relative to path, mtime, size) of the *.vcf files below path,
+  # directories are scanned by jobs threads
+  def _scan_dir(self, path, jobs):
+    files = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(jobs, 1)) as executor:
+      pending = {executor.submit(_scan_one_dir, path)}
+      while pending:
+        done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+        for future in done:
+          dirs, found = future.result()
+          files += found
+          pending |= {executor.submit(_scan_one_dir, dirname) for dirname in dirs}
+    return sorted((os.path.relpath(filename, path), mtime, size) for filename, mtime, size in files)
+
+  # returns {name: [contacts]} of the converted files, failed files are missing
+  def _convert_files(self, path, names, vipGroups, picture_path, fast_parser, jobs, logger):
+    if jobs <= 1 or len(names) < 2:
+      results = _get_contacts_files(path, names, vipGroups, picture_path, fast_parser, logger)
+      return {name: contacts for name, contacts in zip(names, results) if contacts is not None}
 
+    # several chunks per process even out files of different size
+    count = min(jobs * 4, len(names))
+    chunks = [names[len(names) * i // count:len(names) * (i + 1) // count] for i in range(count)]
+    ret = {}
+    stats = fritzbox.stats.get()
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+      futures = [executor.submit(_get_contacts_files_job, path, chunk, vipGroups, picture_path, fast_parser, logger)
+                 for chunk in chunks]
+      try:
+        for chunk, future in zip(chunks, futures):
+          books, counts, data = future.result()
+          stats.add(data)
+          contacts = iter(books.phonebookList[0].contactList)
+          for name, n in zip(chunk, counts):
+            if n is not None:
+              ret[name] = [next(contacts) for i in range(n)]
+      finally:
+        for future in futures:
+          future.cancel()
+    return ret
+
+  # returns list of (start, end) byte offsets of the file, each range holds whole cards
+  def _get_ranges(self, filename, jobs):
+    size = os.path.getsize(filename)
+    # several ranges per process even out cards of different size, e.g. with photos
+    count = min(jobs * 4, size // _RANGE_SIZE_MIN)
+    if count < 2:
+      return [(0, size)]
+    ranges = []
+    start = 0
+    with open(filename, "rb") as infile, mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ) as data:
+      for i in range(1, count):
+        if start >= size * i // count:
+          continue
+        m = _CARD_BOUNDARY.search(data, size * i // count)
+        if m is None:
+          break
+        ranges.append((start, m.start(1)))
+        start = m.start(1)
+    ranges.append((start, size))
+    return ranges
+
+  # converts the ranges in worker processes, the contacts are added in the order of the file
+  def _get_books_parallel(self, filename, ranges, vipGroups, picture_path, fast_parser, jobs, logger):
+    book = fritzbox.phonebook.Phonebook()
+    stats = fritzbox.stats.get()
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+      futures = [executor.submit(_get_books_range, filename, start, end, vipGroups, picture_path, fast_parser, logger)
+                 for start, end in ranges]
+      try:
+        for future in futures:
+          part, data = future.result()
+          stats.add(data)
+          for contact in part.phonebookList[0].contactList:
+            book.addContact(contact)
+      finally:
+        for future in futures:
+          future.cancel()
 
-  def get_books_by_cards(self, cards, vipGroups, picture_path, logger: logging.Logger):
+    books = fritzbox.phonebook.Phonebooks()
+    books.addPhonebook(book)
+    return books
+
+
+  # yields the text of each BEGIN:VCARD ... END:VCARD block of the file, nested vCards
+  # (e.g. AGENT) stay within their card, lines outside of cards are skipped
+  def _iter_card_texts(self, infile):
+    lines = []
+    depth = 0
+    for line in infile:
+      # most lines are properties or folded photo data, only look closer at BEGIN/END
+      tag = line.rstrip().upper() if line[0] in "BbEe" else ""
+      if tag == "BEGIN:VCARD":
+        depth += 1
+      elif depth == 0:
+        continue
+      lines.append(line)
+      if tag == "END:VCARD":
+        depth -= 1
+        if depth == 0:
+          yield "".join(lines)
+          lines = []
+    if lines:
+      # unterminated card, let the parser report it
+      yield "".join(lines)
+
+
+  # photo_jobs: number of processes resizing and saving photos while the cards are converted
+  def get_books_by_cards(self, cards, vipGroups, picture_path, logger: logging.Logger, photo_jobs=1):
+    book = fritzbox.phonebook.Phonebook()
+    photos = _Photos(photo_jobs, logger)
+    try:
+      self._convert_cards(cards, vipGroups, picture_path, logger, book, photos)
+    finally:
+      photos.close()
+
+    books = fritzbox.phonebook.Phonebooks()
+    books.addPhonebook(book)
+    return books
+
+  # adds the contacts of the cards to book, photos are saved with class _Photos
+  def _convert_cards(self, cards, vipGroups, picture_path, logger, book, photos):
     # phone number: CardDav to Fritz!Box
     map_number_types = {
       "work":   "work",
@@ -62,8 +244,7 @@ class Import(object):
       "png":        "png"
     }
 
-    book = fritzbox.phonebook.Phonebook()
-    for card in cards: # card: vobject.base.Component
+    for card in cards: # card: vobject.base.Component or fritzbox.vcard.Card
       #logger.debug(card)
 
       # name
@@ -137,52 +318,16 @@ class Import(object):
           logger.error("Unknown photo encoding (%s %s): '%s'" % (givenName, familyName, card.photo.encoding_param.lower()))
           continue
 
-        if not os.path.exists(picture_path):
-          os.makedirs(picture_path)
-
-        # try to have a nice filename (format must be jpg)
-        fname = "%s %s" % (givenName, familyName)
-        fname = fname.replace(u"ä", "ae").replace(u"ö", "oe").replace(u"ü", "ue")
-        fname = fname.replace(u"é", "e").replace(u"è", "e").replace(u"ç", "c")
-        fname = re.sub(r"[^a-z0-9]", " ", fname, flags=re.I)
-        fname = " ".join(fname.split())
-        fname = fname.replace(" ", "_")
-        fname = fname.lower()
-        fname = "%s.jpg" % fname
-
-        # copy into Image object
-        imgtype = map_image_types[itype]
-        tmp = os.path.join(picture_path, "tmp.%s" % imgtype)
-        with open(tmp, "wb") as outfile:
-          outfile.write(card.photo.value)
-        img = Image.open(tmp)
-        os.remove(tmp)
-
-        # make image fit on Fritz!Fon
-        max_size = (128, 128)
-        width, height = img.size
-        if width != height:
-          logger.warn("Photo not square (%s %s %s): make it square with %s" % (givenName, familyName, img.size, max_size))
-          img = ImageOps.fit(img, max_size, Image.BICUBIC)
-        elif img.size > max_size:
-          logger.warn("Photo too big (%s %s %s): resize to %s" % (givenName, familyName, img.size, max_size))
-          img = img.resize(max_size, Image.BICUBIC)
-
-        # remove alpha channel if there
-        img = img.convert("RGB")
-
-        # save          
-        img.save(os.path.join(picture_path, fname))
-        imageURL = "file:///var/InternerSpeicher/FRITZ/fonpix/%s" % fname
+        os.makedirs(picture_path, exist_ok=True)
+
+        # file name from the photo bytes (format must be jpg)
+        fname = photos.save(card.photo.value, picture_path, "%s %s" % (givenName, familyName))
+        imageURL = fritzbox.fonpix.getURL(fname)
 
       if telephony.hasNumbers():
         person = fritzbox.phonebook.Person(givenName, familyName, imageURL)
         contact = fritzbox.phonebook.Contact(category, person, telephony, services)
         book.addContact(contact)
-    
-    books = fritzbox.phonebook.Phonebooks()
-    books.addPhonebook(book)
-    return books
 
   def _get_params_type(self, params_types, map_types):
     for a in params_types:
@@ -190,3 +335,202 @@ class Import(object):
         if a.lower() == key:
           return key
     return None
+
+
+# a card starting after the end of the previous one, nested cards (e.g. AGENT) are within their card
+_CARD_BOUNDARY = re.compile(rb"(?im)^END:VCARD\r?\n(BEGIN:VCARD)\r?$")
+# smallest part of a file converted by a worker process
+_RANGE_SIZE_MIN = 256 * 1024
+
+
+# converts the cards of the byte range of the file, runs in a worker process with jobs > 1
+# returns the books and the collected stats
+def _get_books_range(filename, start, end, vipGroups, picture_path, fast_parser, logger):
+  fritzbox.stats.use(fritzbox.stats.Stats())
+  with open(filename, "rb") as infile, mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ) as data:
+    text = data[start:end].decode("utf-8-sig" if start == 0 else "utf-8")
+  vcf = Import()
+  readOne = fritzbox.vcard.readOne if fast_parser else vobject.readOne
+  cards = (readOne(card) for card in vcf._iter_card_texts(io.StringIO(text, newline="")))
+  books = vcf.get_books_by_cards(cards, vipGroups, picture_path, logger)
+  # much faster to pickle than the contact objects
+  books.compact()
+  return books, fritzbox.stats.get().asDict()
+
+
+# returns ([subdirectories], [(filename, mtime, size)] of the *.vcf files) of dirname,
+# hidden entries (e.g. .git, temporary files) are skipped
+def _scan_one_dir(dirname):
+  dirs = []
+  files = []
+  with os.scandir(dirname) as entries:
+    for entry in entries:
+      if entry.name.startswith("."):
+        continue
+      if entry.is_dir():
+        dirs.append(entry.path)
+      elif entry.name.lower().endswith(".vcf") and entry.is_file():
+        stat = entry.stat()
+        files.append((entry.path, stat.st_mtime_ns, stat.st_size))
+  return dirs, files
+
+
+# returns list of [contacts] per file name, None if the file failed
+def _get_contacts_files(path, names, vipGroups, picture_path, fast_parser, logger):
+  vcf = Import()
+  readOne = fritzbox.vcard.readOne if fast_parser else vobject.readOne
+  ret = []
+  for name in names:
+    try:
+      with open(os.path.join(path, name), "r", encoding="utf-8-sig", newline="") as infile:
+        cards = [readOne(text) for text in vcf._iter_card_texts(infile)]
+      books = vcf.get_books_by_cards(cards, vipGroups, picture_path, logger)
+      ret.append(list(books.phonebookList[0].contactList))
+    except Exception as ex:
+      logger.error("Failed to parse vCard file %s: %s" % (name, ex))
+      fritzbox.stats.get().count("files_failed")
+      ret.append(None)
+  return ret
+
+
+# runs _get_contacts_files in a worker process
+# returns (books with the contacts of all files, [number of contacts per file, None if failed], collected stats)
+def _get_contacts_files_job(path, names, vipGroups, picture_path, fast_parser, logger):
+  fritzbox.stats.use(fritzbox.stats.Stats())
+  book = fritzbox.phonebook.Phonebook()
+  counts = []
+  for contacts in _get_contacts_files(path, names, vipGroups, picture_path, fast_parser, logger):
+    counts.append(None if contacts is None else len(contacts))
+    for contact in contacts or []:
+      book.addContact(contact)
+  books = fritzbox.phonebook.Phonebooks()
+  books.addPhonebook(book)
+  # much faster to pickle than the contact objects
+  books.compact()
+  return books, counts, fritzbox.stats.get().asDict()
+
+
+# Fritz!Fon photo size
+PHOTO_SIZE = (128, 128)
+
+
+# makes the photo fit on the Fritz!Fon and saves it as JPEG, runs in a worker process with photo_jobs > 1
+# label: name of the contact for the warnings
+# returns (warnings, resized)
+def _save_photo(data, filename, label):
+  warnings = []
+  resized = False
+  img = Image.open(io.BytesIO(data))
+  size = img.size
+  width, height = size
+  if width != height:
+    warnings.append("Photo not square (%s %s): make it square with %s" % (label, size, PHOTO_SIZE))
+    # JPEG: decode at a reduced scale, still at least PHOTO_SIZE
+    img.draft("RGB", PHOTO_SIZE)
+    img = ImageOps.fit(img, PHOTO_SIZE, Image.BICUBIC)
+    resized = True
+  elif size > PHOTO_SIZE:
+    warnings.append("Photo too big (%s %s): resize to %s" % (label, size, PHOTO_SIZE))
+    img.draft("RGB", PHOTO_SIZE)
+    img = img.resize(PHOTO_SIZE, Image.BICUBIC)
+    resized = True
+
+  # remove alpha channel if there
+  img = img.convert("RGB")
+  # an existing file is always complete, see _Photos.save
+  tmp = "%s.%d.tmp" % (filename, os.getpid())
+  img.save(tmp, "JPEG")
+  os.replace(tmp, filename)
+  return warnings, resized
+
+
+# Saves photos with _save_photo, with jobs > 1 in worker processes while the caller goes on.
+# Results are handled in the order of the photos, so warnings are logged as without workers.
+# Photos are named with fritzbox.fonpix.getFilename, an existing file is reused.
+class _Photos(object):
+  def __init__(self, jobs, logger: logging.Logger):
+    self.jobs = jobs
+    self.logger = logger
+    self.executor = None
+    self.pending = collections.deque()
+    self.files = set()  # file names saved during this import
+
+  # path: fonpix folder
+  # returns the file name of the photo in path
+  def save(self, data, path, label):
+    stats = fritzbox.stats.get()
+    name = fritzbox.fonpix.getFilename(data)
+    filename = os.path.join(path, name)
+    if name in self.files or os.path.exists(filename):
+      # same photo as before, e.g. unchanged or shared by several contacts
+      stats.count("photos_cached")
+      return name
+    self.files.add(name)
+    fritzbox.fonpix.addToManifest(path, [name])
+
+    with stats.timer("photos"):
+      if self.jobs <= 1:
+        self._done(_save_photo(data, filename, label))
+        return name
+      if self.executor is None:
+        self.executor = concurrent.futures.ProcessPoolExecutor(max_workers=self.jobs)
+      self.pending.append(self.executor.submit(_save_photo, data, filename, label))
+      # limit the photos kept in memory
+      while len(self.pending) > self.jobs * 4:
+        self._done(self.pending.popleft().result())
+    return name
+
+  def _done(self, result):
+    warnings, resized = result
+    for warning in warnings:
+      self.logger.warn(warning)
+    stats = fritzbox.stats.get()
+    if resized:
+      stats.count("photos_resized")
+    stats.count("photos")
+
+  # waits for all photos to be saved
+  def close(self):
+    stats = fritzbox.stats.get()
+    try:
+      with stats.timer("photos"):
+        while self.pending:
+          self._done(self.pending.popleft().result())
+    finally:
+      if self.executor is not None:
+        self.executor.shutdown(cancel_futures=True)
+        self.executor = None
+
+
+# Contacts converted from the files of a vCard directory, reused while a file keeps its mtime and size.
+# One cache per directory.
+class VCardFileCache(object):
+  def __init__(self, filename):
+    self.filename = filename
+    self.data = {}
+    if os.path.exists(filename):
+      with open(filename, "rb") as infile:
+        self.data = pickle.load(infile)
+
+  # returns [contacts] if cached with the same mtime and size, else None
+  def get(self, name, mtime, size):
+    entry = self.data.get("files", {}).get(name)
+    if entry is None or entry[0] != mtime or entry[1] != size:
+      return None
+    return entry[2]
+
+  def getSettings(self):
+    return self.data.get("settings")
+
+  # files: {name: (mtime, size, [contacts])}, all files of the directory, others are evicted
+  def update(self, files, settings):
+    self.data = {"settings": settings, "files": files}
+
+  def save(self):
+    dirname = os.path.dirname(self.filename)
+    if dirname and not os.path.exists(dirname):
+      os.makedirs(dirname, exist_ok=True)
+    tmp = self.filename + ".tmp"
+    with open(tmp, "wb") as outfile:
+      pickle.dump(self.data, outfile, pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, self.filename)
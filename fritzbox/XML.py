@@ -0,0 +1,88 @@
+# python-fritzbox - Automate the Fritz!Box with python
+# Copyright (C) 2015-2024 Patrick Ammann <pammann@gmx.net>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+#
+
+import logging
+from datetime import datetime
+import xml.etree.ElementTree as ET
+
+# fritzbox
+import fritzbox.phonebook
+import fritzbox.stats
+
+
+# Reads the Fritz!Box phonebook XML format, as written by Phonebooks.write().
+# The file is parsed incrementally, each <contact> element is freed once converted.
+class Import(object):
+  def get_books(self, filename, vipGroups, logger: logging.Logger=logging.getLogger()):
+    stats = fritzbox.stats.get()
+    with stats.timer("import"):
+      books = self._parse(filename, logger)
+    stats.countBooks(books)
+    return books
+
+  def _parse(self, filename, logger: logging.Logger):
+    books = fritzbox.phonebook.Phonebooks()
+    book = None
+    bookElem = None
+    for event, elem in ET.iterparse(filename, events=("start", "end")):
+      if event == "start":
+        if elem.tag == "phonebook":
+          book = fritzbox.phonebook.Phonebook(name=elem.get("name"))
+          bookElem = elem
+        continue
+      if elem.tag == "contact" and bookElem is not None:
+        book.addContact(self._get_contact(elem, logger))
+        bookElem.remove(elem)
+      elif elem.tag == "phonebook":
+        books.addPhonebook(book)
+        elem.clear()
+        book = None
+        bookElem = None
+    return books
+
+  def _get_contact(self, elem, logger: logging.Logger):
+    # the real name can not be split reliably, it is kept as given name
+    realName = elem.findtext("person/realName")
+    imageURL = elem.findtext("person/imageURL")
+    person = fritzbox.phonebook.Person(realName, "", imageURL)
+
+    telephony = fritzbox.phonebook.Telephony()
+    for number in elem.iterfind("telephony/number"):
+      ntype = number.get("type")
+      if ntype not in fritzbox.phonebook.NUMBER_TYPES:
+        logger.warning("Unsupported number type, skipping number (%s, %s)" % (realName, ntype))
+        continue
+      telephony.addNumber(ntype, number.text or "", int(number.get("prio", "0")),
+                          number.get("vanity"), number.get("quickdial"))
+
+    services = None
+    for email in elem.iterfind("services/email"):
+      etype = email.get("classifier")
+      if etype != "private":
+        logger.warning("Unsupported email type, skipping email (%s, %s)" % (realName, etype))
+        continue
+      if services is None: services = fritzbox.phonebook.Services()
+      services.addEmail(etype, email.text or "")
+
+    category = int(elem.findtext("category") or "0")
+    mod_datetime = None
+    mod_time = elem.findtext("mod_time")
+    if mod_time:
+      mod_datetime = datetime.fromtimestamp(int(mod_time))
+
+    return fritzbox.phonebook.Contact(category, person, telephony, services, mod_datetime=mod_datetime)
@@ -0,0 +1,93 @@
+# python-fritzbox - Automate the Fritz!Box with python
+# Copyright (C) 2015-2024 Patrick Ammann <pammann@gmx.net>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+#
+
+# Contact photos in the local fonpix folder, named by a hash of the source photo.
+# An existing file is reused without decoding the photo again, identical photos are
+# stored once. The manifest lists the files created here, one name per line, only
+# those are removed by cleanup().
+
+import os
+import hashlib
+
+
+# part of the file names, change when the generated photos change (e.g. size)
+PHOTO_VERSION = "128x128-1"
+URL = "file:///var/InternerSpeicher/FRITZ/fonpix/"
+MANIFEST = "fonpix.manifest"
+
+
+# returns the file name of the photo generated from data (source photo bytes)
+def getFilename(data):
+  return hashlib.sha1(PHOTO_VERSION.encode("ascii") + data).hexdigest()[:20] + ".jpg"
+
+
+def getURL(filename):
+  return URL + filename
+
+
+# returns False if the contact's photo is in the fonpix folder path but its file is missing,
+# e.g. a cached contact whose photo was removed by cleanup() in a run without this contact
+def photoExists(path, contact):
+  imageURL = contact.person.imageURL if contact is not None else None
+  if path is None or not imageURL or not imageURL.startswith(URL):
+    return True
+  return os.path.exists(os.path.join(path, imageURL[len(URL):]))
+
+
+# names: file names about to be created in path
+def addToManifest(path, names):
+  with open(os.path.join(path, MANIFEST), "a", encoding="utf-8") as outfile:
+    for name in names:
+      outfile.write(name + "\n")
+
+
+def _readManifest(path):
+  filename = os.path.join(path, MANIFEST)
+  if not os.path.exists(filename):
+    return set()
+  with open(filename, "r", encoding="utf-8") as infile:
+    return set(line.strip() for line in infile if line.strip())
+
+
+# removes the photos of the manifest not used by any contact of phonebooks
+# phonebooks: class fritzbox.phonebook.Phonebooks
+# returns the number of removed files
+def cleanup(path, phonebooks):
+  used = set()
+  for book in phonebooks.phonebookList:
+    for contact in book.contactList:
+      imageURL = contact.person.imageURL
+      if imageURL and imageURL.startswith(URL):
+        used.add(imageURL[len(URL):])
+
+  removed = 0
+  kept = []
+  for name in sorted(_readManifest(path)):
+    filename = os.path.join(path, name)
+    if name in used:
+      if os.path.exists(filename): kept.append(name)
+    elif os.path.exists(filename):
+      os.remove(filename)
+      removed += 1
+
+  tmp = os.path.join(path, MANIFEST + ".tmp")
+  with open(tmp, "w", encoding="utf-8") as outfile:
+    for name in kept:
+      outfile.write(name + "\n")
+  os.replace(tmp, os.path.join(path, MANIFEST))
+  return removed
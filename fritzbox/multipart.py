@@ -21,14 +21,15 @@
 import mimetypes
 import random
 import string
-import itertools
 
 
 # modified version based on: https://pymotw.com/2/urllib2/
 class MultiPartForm(object):
-    def __init__(self):
+    def __init__(self, encoding="utf-8"):
+        self.encoding = encoding
         self.form_fields = []
         self.files = []
+        self._consumed = set()  # id() of one-shot chunk iterators already sent
         boundary_chars = string.digits + string.ascii_letters
         self.boundary = ''.join(random.choice(boundary_chars) for i in range(30))
 
@@ -43,48 +44,92 @@ class MultiPartForm(object):
     def add_file(self, fieldname, filename, fileHandle, mimetype=None):
         """Add a file to be uploaded."""
         body = fileHandle.read()
+        if isinstance(body, str): body = body.encode(self.encoding)
+        self.add_file_chunks(fieldname, filename, [body], len(body), mimetype)
+
+    def add_file_chunks(self, fieldname, filename, chunks, length, mimetype=None):
+        """Add a file to be uploaded, given as iterable of bytes with a total size of length bytes,
+        or as callable without arguments returning a new such iterable each time the body is iterated.
+        The chunks are only consumed when iterating over the body, an iterator can only be sent once."""
         if mimetype is None:
             mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
-        self.files.append((fieldname, filename, mimetype, body))
+        self.files.append((fieldname, filename, mimetype, chunks, length))
 
     def _escape_quote(self, s):
         return s.replace('"', '\\"')
 
-    def __str__(self):
-        """Return a string representing the form data, including attached files."""
-        # Build a list of lists, each containing "lines" of the
-        # request.  Each part is separated by a boundary string.
-        # Once the list is built, return a string where each
-        # line is separated by '\r\n'.  
-        parts = []
+    def _segments(self):
+        """Return the form data as list of bytes and (chunks, length) file contents."""
+        # Each part is separated by a boundary string and each
+        # "line" is terminated by CR+LF. Headers and fields are
+        # encoded here, the file contents are passed through.
+        segments = []
         part_boundary = '--' + self.boundary
-        
+
         # Add the form fields
-        parts.extend(
-            [ part_boundary,
-              'Content-Disposition: form-data; name="%s"' % self._escape_quote(name),
-              '',
-              value,
-            ]
-            for name, value in self.form_fields
-            )
-        
+        for name, value in self.form_fields:
+            lines = [
+                part_boundary,
+                'Content-Disposition: form-data; name="%s"' % self._escape_quote(name),
+                '',
+                value,
+                '']
+            segments.append('\r\n'.join(lines).encode(self.encoding))
+
         # Add the files to upload
-        parts.extend(
-            [ part_boundary,
-              'Content-Disposition: file; name="%s"; filename="%s"' % \
-                 (self._escape_quote(field_name), self._escape_quote(filename)),
-              'Content-Type: %s' % content_type,
-              '',
-              body,
-            ]
-            for field_name, filename, content_type, body in self.files
-            )
-        
-        # Flatten the list and add closing boundary marker,
-        # then return CR+LF separated data
-        flattened = list(itertools.chain(*parts))
-        flattened.append('--' + self.boundary + '--')
-        flattened.append('')
-        return '\r\n'.join(flattened)
+        for field_name, filename, content_type, chunks, length in self.files:
+            lines = [
+                part_boundary,
+                'Content-Disposition: file; name="%s"; filename="%s"' % \
+                    (self._escape_quote(field_name), self._escape_quote(filename)),
+                'Content-Type: %s' % content_type,
+                '',
+                '']
+            segments.append('\r\n'.join(lines).encode(self.encoding))
+            segments.append((chunks, length))
+            segments.append(b'\r\n')
+
+        # Add closing boundary marker
+        segments.append(('--' + self.boundary + '--\r\n').encode(self.encoding))
+        return segments
+
+    def get_content_length(self):
+        """Return the size of the form data in bytes, without consuming any file chunks."""
+        return sum(len(s) if isinstance(s, bytes) else s[1] for s in self._segments())
 
+    def _open_chunks(self, chunks):
+        """Return the iterable of file contents, raise ValueError if it was already consumed."""
+        if callable(chunks):
+            return chunks()
+        if iter(chunks) is chunks:
+            if id(chunks) in self._consumed:
+                raise ValueError("file chunks already consumed, add them as callable to send the form again")
+            self._consumed.add(id(chunks))
+        return chunks
+
+    def iter_body(self):
+        """Return an iterator over the form data as bytes, including attached files."""
+        segments = self._segments()
+        # fail before anything is sent, not with a truncated body
+        files = [self._open_chunks(s[0]) for s in segments if not isinstance(s, bytes)]
+        return self._iter_segments(segments, files)
+
+    def _iter_segments(self, segments, files):
+        files = iter(files)
+        for s in segments:
+            if isinstance(s, bytes):
+                yield s
+                continue
+            sent = 0
+            for chunk in next(files):
+                sent += len(chunk)
+                yield chunk
+            if sent != s[1]:
+                raise ValueError("file chunks have %d bytes instead of %d" % (sent, s[1]))
+
+    def __bytes__(self):
+        return b''.join(self.iter_body())
+
+    def __str__(self):
+        """Return a string representing the form data, one character per byte."""
+        return bytes(self).decode('iso-8859-1')
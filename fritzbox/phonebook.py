@@ -16,25 +16,73 @@
 # Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
 #
 
+import os
 import re
+import hashlib
+import functools
+from array import array
 from datetime import datetime
-import tempfile
 import xml.etree.ElementTree as ET
-from xml.dom.minidom import parseString
 
 # fritzbox modules
 import fritzbox.multipart
+import fritzbox.stats
 
 
 class PhonebookException(Exception):
   pass
 
 
+XML_ENCODING = "iso-8859-1"
+XML_INDENT = "  "
+
+
+def _escapeXML(data):
+  return data.replace("&", "&amp;").replace("<", "&lt;").replace("\"", "&quot;").replace(">", "&gt;")
+
+
+# pretty print an element tree, one element per line (same layout as minidom.toprettyxml)
+def _formatXML(elem, level=0):
+  lines = []
+  def _format(elem, level):
+    indent = XML_INDENT * level
+    attrs = "".join(' %s="%s"' % (key, _escapeXML(value)) for key, value in elem.items())
+    if len(elem):
+      lines.append("%s<%s%s>\n" % (indent, elem.tag, attrs))
+      for child in elem:
+        _format(child, level + 1)
+      lines.append("%s</%s>\n" % (indent, elem.tag))
+    elif elem.text:
+      lines.append("%s<%s%s>%s</%s>\n" % (indent, elem.tag, attrs, _escapeXML(elem.text), elem.tag))
+    else:
+      lines.append("%s<%s%s/>\n" % (indent, elem.tag, attrs))
+  _format(elem, level)
+  return "".join(lines)
+
+
+_NON_NUMBER_CHARS = re.compile(r"[^0-9\+ ]")
+
+
+# number: string as entered by the user
+# countryCode: e.g. +41, used for numbers starting with a single 0
+# Numbers repeat a lot across sources, the results are cached.
+@functools.lru_cache(maxsize=65536)
+def normalizeNumber(number, countryCode):
+  number = _NON_NUMBER_CHARS.sub("", number).strip()
+  if number.startswith("00"):
+    return "+" + number[2:]
+  if number.startswith("0"):
+    return countryCode + number[1:]
+  return number
+
+
 class OptionsXML(object):
   familyNameFirst = False
 
 
 class Person(object):
+  __slots__ = ("givenName", "familyName", "imageURL")
+
   # givenName: string | None
   # familyName: string | None
   # imageURL: e.g. file:///var/InternerSpeicher/FRITZ/fonpix/1.jpg
@@ -59,6 +107,8 @@ class Person(object):
 
 
 class Telephony(object):
+  __slots__ = ("numberDict",)
+
   def __init__(self):
     self.numberDict = {}
 
@@ -78,9 +128,7 @@ class Telephony(object):
   def normalizeNumbers(self, countryCode):
     for ntype in self.numberDict:
       (number, nprio, vanity, quickdial) = self.numberDict[ntype]
-      number = re.sub(r"[^0-9\+ ]", "", number).strip()
-      number = re.sub(r"^00", "+", number)
-      number = re.sub(r"^0", countryCode, number)
+      number = normalizeNumber(number, countryCode)
       self.numberDict[ntype] = (number, nprio, vanity, quickdial)
 
   def calculateMainNumber(self):
@@ -107,6 +155,8 @@ class Telephony(object):
 
 
 class Services(object):
+  __slots__ = ("emailDict",)
+
   def __init__(self):
     self.emailDict = {}
 
@@ -125,6 +175,8 @@ class Services(object):
 
 
 class Contact(object):
+  __slots__ = ("category", "person", "telephony", "services", "mod_datetime")
+
   # category: Very important person: 1, else 0
   # person: class Person
   # telephony: class Telephony
@@ -146,6 +198,22 @@ class Contact(object):
     self.services = services
     self.mod_datetime  = mod_datetime
 
+  # key identifying the contact between runs: its name, or its numbers if there is no name
+  def getKey(self):
+    name = " ".join(("%s %s" % (self.person.givenName, self.person.familyName)).split())
+    if name: return name
+    return " ".join(number for (number, nprio, vanity, quickdial) in self.telephony.numberDict.values())
+
+  # hash over the content written to the Fritz!Box, without mod_datetime
+  # which is often just the import time
+  def getHash(self):
+    content = repr((
+      self.category,
+      self.person.givenName, self.person.familyName, self.person.imageURL,
+      sorted(self.telephony.numberDict.items()),
+      sorted(self.services.emailDict.items()) if self.services else []))
+    return hashlib.sha1(content.encode("utf-8")).hexdigest()
+
   def normalizeNumbers(self, countryCode):
     self.telephony.normalizeNumbers(countryCode)
 
@@ -171,13 +239,18 @@ class Phonebook(object):
     self.name = name
     self.contactList = []
 
+  def clearContacts(self):
+    self.contactList = []
+
   # contact: class Contact
   def addContact(self, contact):
     self.contactList.append(contact)
 
   def normalizeNumbers(self, countryCode):
     for contact in self.contactList:
-      contact.normalizeNumbers(countryCode)
+      numberDict = contact.telephony.numberDict
+      for ntype, (number, nprio, vanity, quickdial) in numberDict.items():
+        numberDict[ntype] = (normalizeNumber(number, countryCode), nprio, vanity, quickdial)
 
   def calculateMainNumber(self):
     for contact in self.contactList:
@@ -190,6 +263,163 @@ class Phonebook(object):
       xml.append(contact.getXML(options))
     return xml
 
+  # yields the pretty printed XML, one contact at a time
+  def iterXML(self, options, level=1):
+    indent = XML_INDENT * level
+    attrs = ' name="%s"' % _escapeXML(self.name) if self.name else ""
+    if len(self.contactList) == 0:
+      yield "%s<phonebook%s/>\n" % (indent, attrs)
+      return
+    yield "%s<phonebook%s>\n" % (indent, attrs)
+    for contact in self.contactList:
+      yield _formatXML(contact.getXML(options), level + 1)
+    yield "%s</phonebook>\n" % indent
+
+
+NUMBER_TYPES = ["home", "mobile", "work", "fax"]
+
+
+# read only sequence of Contact objects, created on access
+class _CompactContactList(object):
+  __slots__ = ("_book",)
+
+  def __init__(self, book):
+    self._book = book
+
+  def __len__(self):
+    return len(self._book._category)
+
+  def __getitem__(self, index):
+    if isinstance(index, slice):
+      return [self._book._getContact(i) for i in range(*index.indices(len(self)))]
+    if index < 0: index += len(self)
+    if not 0 <= index < len(self): raise IndexError("contact index out of range")
+    return self._book._getContact(index)
+
+  def __iter__(self):
+    for i in range(len(self)):
+      yield self._book._getContact(i)
+
+
+# Phonebook storing the contacts in parallel arrays instead of one object per contact.
+# Names, image URLs and modification times are interned, they often repeat in blocklists.
+# Numbers are stored in rows, contact i owns the rows numberStart[i] to numberStart[i+1].
+# contactList returns freshly created Contact objects: changes to them are not stored,
+# use addContact(), normalizeNumbers() and calculateMainNumber() instead.
+class CompactPhonebook(Phonebook):
+  def __init__(self, owner=0, name=None):
+    self.name = name
+    self.clearContacts()
+
+  def clearContacts(self):
+    self._interned = {}
+    self._category = array("b")
+    self._givenName = []
+    self._familyName = []
+    self._imageURL = []
+    self._modDatetime = []
+    self._services = {}          # contact index -> Services, only if there are emails
+    self._numberStart = array("L", [0])
+    self._numberType = array("b")  # index into NUMBER_TYPES
+    self._number = []            # numbers are rarely shared, not interned
+    self._prio = array("b")
+    self._numberExtra = {}       # number row -> (vanity, quickdial), only if set
+
+  def _intern(self, value):
+    if value is None: return None
+    return self._interned.setdefault(value, value)
+
+  @property
+  def contactList(self):
+    return _CompactContactList(self)
+
+  # contact: class Contact
+  def addContact(self, contact):
+    index = len(self._category)
+    self._category.append(contact.category)
+    self._givenName.append(self._intern(contact.person.givenName))
+    self._familyName.append(self._intern(contact.person.familyName))
+    self._imageURL.append(self._intern(contact.person.imageURL))
+    self._modDatetime.append(self._intern(contact.mod_datetime))
+    if contact.services and contact.services.emailDict:
+      self._services[index] = contact.services
+    for ntype, (number, prio, vanity, quickdial) in contact.telephony.numberDict.items():
+      if vanity or quickdial:
+        self._numberExtra[len(self._number)] = (vanity, quickdial)
+      self._numberType.append(NUMBER_TYPES.index(ntype))
+      self._number.append(number)
+      self._prio.append(prio)
+    self._numberStart.append(len(self._number))
+
+  def _getContact(self, index):
+    person = Person(self._givenName[index], self._familyName[index], self._imageURL[index])
+    telephony = Telephony()
+    for row in range(self._numberStart[index], self._numberStart[index + 1]):
+      vanity, quickdial = self._numberExtra.get(row, (None, None))
+      telephony.numberDict[NUMBER_TYPES[self._numberType[row]]] = (self._number[row], self._prio[row], vanity, quickdial)
+    return Contact(self._category[index], person, telephony, self._services.get(index),
+                   mod_datetime=self._modDatetime[index])
+
+  def normalizeNumbers(self, countryCode):
+    self._number = [normalizeNumber(number, countryCode) for number in self._number]
+
+  def calculateMainNumber(self):
+    # same priority as Telephony.calculateMainNumber: home, mobile, work
+    prio_rank = [0, 1, 2, None]
+    numberType = self._numberType
+    start = self._numberStart
+    for index in range(len(self._category)):
+      main_row = None
+      main_rank = None
+      for row in range(start[index], start[index + 1]):
+        rank = prio_rank[numberType[row]]
+        if rank is not None and (main_rank is None or rank < main_rank):
+          main_row = row
+          main_rank = rank
+      if main_row is not None:
+        self._prio[main_row] = 1
+
+
+MERGE_KEEP_FIRST = "first"
+MERGE_KEEP_NEWEST = "newest"
+MERGE_UNION = "union"
+
+
+# keys identifying a contact: its numbers (without spaces) and its name (case and spaces ignored)
+def _getMergeKeys(contact, matchNames):
+  keys = []
+  for (number, nprio, vanity, quickdial) in contact.telephony.numberDict.values():
+    number = number.replace(" ", "")
+    if number: keys.append(("number", number))
+  if matchNames:
+    name = " ".join(("%s %s" % (contact.person.givenName, contact.person.familyName)).split()).casefold()
+    if name: keys.append(("name", name))
+  return keys
+
+
+def _mergeContacts(contact, other, policy):
+  if policy == MERGE_KEEP_FIRST:
+    return contact
+  if policy == MERGE_KEEP_NEWEST:
+    if other.mod_datetime and (not contact.mod_datetime or other.mod_datetime > contact.mod_datetime):
+      return other
+    return contact
+  # MERGE_UNION: a number type can hold one number only, the first one wins
+  # adopted numbers are not main numbers, the contact keeps its own main number
+  numberDict = contact.telephony.numberDict
+  for ntype, (number, nprio, vanity, quickdial) in other.telephony.numberDict.items():
+    if ntype not in numberDict:
+      numberDict[ntype] = (number, 0, vanity, quickdial)
+  if other.services:
+    if not contact.services: contact.services = Services()
+    for etype, email in other.services.emailDict.items():
+      contact.services.emailDict.setdefault(etype, email)
+  if not contact.person.imageURL: contact.person.imageURL = other.person.imageURL
+  contact.category = max(contact.category, other.category)
+  if other.mod_datetime and (not contact.mod_datetime or other.mod_datetime > contact.mod_datetime):
+    contact.mod_datetime = other.mod_datetime
+  return contact
+
 
 class Phonebooks(object):
   def __init__(self):
@@ -203,59 +433,159 @@ class Phonebooks(object):
   def addPhonebooks(self, phonebooks):
     self.phonebookList += phonebooks.phonebookList
 
+  # convert all phone books into CompactPhonebook
+  def compact(self):
+    for i, book in enumerate(self.phonebookList):
+      if isinstance(book, CompactPhonebook):
+        continue
+      compactBook = CompactPhonebook(name=book.name)
+      for contact in book.contactList:
+        compactBook.addContact(contact)
+      self.phonebookList[i] = compactBook
+
   def normalizeNumbers(self, countryCode):
-    for book in self.phonebookList:
-      book.normalizeNumbers(countryCode)
+    with fritzbox.stats.get().timer("normalize"):
+      for book in self.phonebookList:
+        book.normalizeNumbers(countryCode)
 
   def calculateMainNumber(self):
+    with fritzbox.stats.get().timer("main_number"):
+      for book in self.phonebookList:
+        book.calculateMainNumber()
+
+  # policy: None to keep all contacts, else contacts with the same number or name are collapsed
+  #   MERGE_KEEP_FIRST: keep the contact seen first
+  #   MERGE_KEEP_NEWEST: keep the contact with the newest mod_datetime
+  #   MERGE_UNION: keep the contact seen first and add the numbers (not as main number) and emails of the others
+  # matchNames: False to collapse only contacts with the same number
+  # returns the number of collapsed contacts
+  def mergeToOnePhonebook(self, policy=None, matchNames=True):
+    stats = fritzbox.stats.get()
+    with stats.timer("merge"):
+      collapsed = self._merge(policy, matchNames)
+    stats.count("collapsed", collapsed)
+    return collapsed
+
+  def _merge(self, policy, matchNames):
+    if len(self.phonebookList) == 0:
+      return 0
+    merged = self.phonebookList[0]
+    if policy is None:
+      for book in self.phonebookList[1:]:
+        for contact in book.contactList:
+          merged.addContact(contact)
+      self.phonebookList = [merged]
+      return 0
+    if policy not in [MERGE_KEEP_FIRST, MERGE_KEEP_NEWEST, MERGE_UNION]:
+      raise PhonebookException("invalid merge policy: '%s'" % policy)
+
+    contacts = []
+    index = {} # merge key -> position in contacts
+    collapsed = 0
+    for book in self.phonebookList:
+      for contact in book.contactList:
+        keys = _getMergeKeys(contact, matchNames)
+        pos = None
+        for key in keys:
+          pos = index.get(key)
+          if pos is not None: break
+        if pos is None:
+          pos = len(contacts)
+          contacts.append(contact)
+        else:
+          collapsed += 1
+          contacts[pos] = _mergeContacts(contacts[pos], contact, policy)
+          keys += _getMergeKeys(contacts[pos], matchNames)
+        for key in keys:
+          index.setdefault(key, pos)
+
+    merged.clearContacts()
+    for contact in contacts:
+      merged.addContact(contact)
+    self.phonebookList = [merged]
+    return collapsed
+
+  # yields the pretty printed XML document in chunks, memory use does not
+  # grow with the number of contacts
+  def iterXML(self, optionsXML=OptionsXML()):
+    yield '<?xml version="1.0" encoding="%s"?>\n' % XML_ENCODING
+    if len(self.phonebookList) == 0:
+      yield "<phonebooks/>\n"
+      return
+    yield "<phonebooks>\n"
     for book in self.phonebookList:
-      book.calculateMainNumber()
+      yield from book.iterXML(optionsXML)
+    yield "</phonebooks>\n"
 
-  def mergeToOnePhonebook(self):
-    merged = None
+  # yields the XML document encoded as bytes, as written by write()
+  def iterEncodedXML(self, optionsXML=OptionsXML()):
+    for chunk in self.iterXML(optionsXML):
+      yield chunk.encode(XML_ENCODING, "xmlcharrefreplace")
+
+  def getEncodedXMLLength(self, optionsXML=OptionsXML()):
+    return sum(len(chunk) for chunk in self.iterEncodedXML(optionsXML))
+
+  # returns (fingerprint of the whole phonebooks, {contact key: contact hash})
+  def getFingerprint(self, optionsXML=OptionsXML()):
+    fingerprint = hashlib.sha1(repr(optionsXML.familyNameFirst).encode("utf-8"))
+    contactHashes = {}
     for book in self.phonebookList:
-      if merged is None:
-        merged = book
-        continue
+      fingerprint.update(repr(book.name).encode("utf-8"))
       for contact in book.contactList:
-        merged.addContact(contact)
-    if merged is not None:
-      self.phonebookList = [merged]
+        contactHash = contact.getHash()
+        fingerprint.update(contactHash.encode("ascii"))
+        key = contact.getKey()
+        n = 1
+        while key in contactHashes:
+          n += 1
+          key = "%s #%d" % (contact.getKey(), n)
+        contactHashes[key] = contactHash
+    return fingerprint.hexdigest(), contactHashes
 
   def write(self, filename, optionsXML=OptionsXML()):
-    xml = ET.Element("phonebooks")
-    for book in self.phonebookList:
-      xml.append(book.getXML(optionsXML))
-    tree = ET.ElementTree(xml)
-    rough_string = ET.tostring(tree.getroot(), encoding="iso-8859-1", method="xml")
-    reparsed = parseString(rough_string)
-    pretty = reparsed.toprettyxml(indent="  ", encoding="iso-8859-1").decode("iso-8859-1")
-    with open(filename, 'w', encoding="iso-8859-1") as outfile:
-      outfile.write(pretty)
+    # characters not available in the encoding are written as character references
+    stats = fritzbox.stats.get()
+    with stats.timer("write"):
+      with open(filename, 'w', encoding=XML_ENCODING, errors="xmlcharrefreplace") as outfile:
+        for chunk in self.iterXML(optionsXML):
+          outfile.write(chunk)
+    stats.count("bytes_written", os.path.getsize(filename))
 
   # sid: Login session ID
   # phonebookid: 0 for main phone book
   #              1 for next phone book in list, etc...
-  def upload(self, session, phonebookid=0):
-    tmpfile = tempfile.NamedTemporaryFile(mode="w")
-    self.write(tmpfile.name)
-    tmpfile.flush()
+  # state: class fritzbox.uploadstate.UploadState, skip upload if nothing changed since last upload
+  # returns None without state, else the changes since last upload: {"added": n, "removed": n, "changed": n}
+  def upload(self, session, phonebookid=0, optionsXML=OptionsXML(), state=None):
+    changes = None
+    if state is not None:
+      fingerprint, contactHashes = self.getFingerprint(optionsXML)
+      changes = state.compare(contactHashes)
+      if fingerprint == state.fingerprint:
+        return changes
 
-    # upload
     sid = session.get_sid()
     form = fritzbox.multipart.MultiPartForm()
     form.add_field("sid", sid)
     form.add_field("PhonebookId", phonebookid)
-    with open(tmpfile.name, "r") as fh:
-      form.add_file("PhonebookImportFile", "book.xml", fh, "text/xml")
-    body = str(form)
-    headers = {'Content-type': form.get_content_type(), 'Content-length': len(body)}
-    resp = session.post("/cgi-bin/firmwarecfg", headers, body)
+    # the book is serialized once to get the length and again each time the form is sent,
+    # so it never has to be held in memory as a whole
+    form.add_file_chunks("PhonebookImportFile", "book.xml", lambda: self.iterEncodedXML(optionsXML),
+                         self.getEncodedXMLLength(optionsXML), "text/xml")
+    body = form.iter_body()
+    length = form.get_content_length()
+    headers = {'Content-type': form.get_content_type(), 'Content-length': str(length)}
+    stats = fritzbox.stats.get()
+    with stats.timer("upload"):
+      resp = session.post("/cgi-bin/firmwarecfg", headers, body)
+    stats.count("bytes_uploaded", length)
     html = resp.read()
-    if html.find("Das Telefonbuch der FRITZ!Box wurde wiederhergestellt.") != 0:
-      pass
-    elif html.find("Beim Wiederherstellen des Telefonbuchs ist ein Fehler aufgetreten.") != 0:
+    if html.find("Das Telefonbuch der FRITZ!Box wurde wiederhergestellt.") != -1:
+      if state is not None:
+        state.update(fingerprint, contactHashes)
+        state.save()
+    elif html.find("Beim Wiederherstellen des Telefonbuchs ist ein Fehler aufgetreten.") != -1:
       print("Error: uploading failed")
     else:
       print("Warning: unknown answer:\n%s" % html)
-
+    return changes
@@ -0,0 +1,108 @@
+# python-fritzbox - Automate the Fritz!Box with python
+# Copyright (C) 2015-2024 Patrick Ammann <pammann@gmx.net>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+#
+
+import time
+import logging
+import threading
+import contextlib
+
+
+# Timers and counters of the phonebook pipeline.
+# Stages: import, photos (part of import), download (part of import), normalize, main_number,
+#         merge, write, upload
+# Counters: contacts, numbers, cards, cards_cached, cards_changed, cards_failed, files, files_cached,
+#           files_failed, photos, photos_resized, photos_cached, collapsed, bytes_written, bytes_uploaded, warnings
+class Stats(object):
+  def __init__(self):
+    self.timers = {}
+    self.counters = {}
+    self._hooks = []
+    # stages and counters can be updated from several threads, e.g. CardDAV downloads
+    self._lock = threading.Lock()
+
+  # hook: function(stats, stage, seconds), called each time a stage finished
+  def addHook(self, hook):
+    self._hooks.append(hook)
+
+  @contextlib.contextmanager
+  def timer(self, stage):
+    start = time.monotonic()
+    try:
+      yield
+    finally:
+      seconds = time.monotonic() - start
+      with self._lock:
+        self.timers[stage] = self.timers.get(stage, 0.0) + seconds
+      for hook in self._hooks:
+        hook(self, stage, seconds)
+
+  def count(self, name, n=1):
+    with self._lock:
+      self.counters[name] = self.counters.get(name, 0) + n
+
+  # phonebooks: class fritzbox.phonebook.Phonebooks
+  def countBooks(self, phonebooks):
+    for book in phonebooks.phonebookList:
+      for contact in book.contactList:
+        self.count("contacts")
+        self.count("numbers", len(contact.telephony.numberDict))
+
+  def asDict(self):
+    return {"timers": dict(self.timers), "counters": dict(self.counters)}
+
+  # data: as returned by asDict(), e.g. from a worker process
+  def add(self, data):
+    for stage, seconds in data["timers"].items():
+      with self._lock:
+        self.timers[stage] = self.timers.get(stage, 0.0) + seconds
+    for name, n in data["counters"].items():
+      self.count(name, n)
+
+  def format(self):
+    lines = ["stage                seconds"]
+    for stage, seconds in self.timers.items():
+      lines.append("%-16s %11.3f" % (stage, seconds))
+    lines.append("counter                value")
+    for name, n in sorted(self.counters.items()):
+      lines.append("%-16s %11d" % (name, n))
+    return "\n".join(lines)
+
+
+# counts logged warnings and errors into the current stats
+class WarningCounter(logging.Handler):
+  def __init__(self):
+    logging.Handler.__init__(self, logging.WARNING)
+
+  def emit(self, record):
+    get().count("warnings")
+
+
+_current = Stats()
+
+
+def get():
+  return _current
+
+
+# stats: class Stats, collects the numbers from now on
+# returns the previous Stats
+def use(stats):
+  global _current
+  previous = _current
+  _current = stats
+  return previous
@@ -0,0 +1,66 @@
+# python-fritzbox - Automate the Fritz!Box with python
+# Copyright (C) 2015-2024 Patrick Ammann <pammann@gmx.net>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+#
+
+import os
+import json
+
+
+# Fingerprint of the phonebook last uploaded to a Fritz!Box phonebook,
+# persisted in a local JSON file holding one entry per (host, phonebookid).
+class UploadState(object):
+  def __init__(self, filename, host, phonebookid=0):
+    self.filename = filename
+    self.key = "%s#%s" % (host, phonebookid)
+    self.fingerprint = None
+    self.contactHashes = {}
+    entry = self._load().get(self.key)
+    if entry:
+      self.fingerprint = entry["fingerprint"]
+      self.contactHashes = entry["contacts"]
+
+  def _load(self):
+    if not os.path.exists(self.filename):
+      return {}
+    with open(self.filename, "r", encoding="utf-8") as infile:
+      return json.load(infile)
+
+  # contactHashes: {contact key: contact hash}, see Phonebooks.getFingerprint()
+  def compare(self, contactHashes):
+    added = removed = changed = 0
+    for key, contactHash in contactHashes.items():
+      old = self.contactHashes.get(key)
+      if old is None: added += 1
+      elif old != contactHash: changed += 1
+    for key in self.contactHashes:
+      if key not in contactHashes: removed += 1
+    return {"added": added, "removed": removed, "changed": changed}
+
+  def update(self, fingerprint, contactHashes):
+    self.fingerprint = fingerprint
+    self.contactHashes = contactHashes
+
+  def save(self):
+    entries = self._load()
+    entries[self.key] = {"fingerprint": self.fingerprint, "contacts": self.contactHashes}
+    dirname = os.path.dirname(self.filename)
+    if dirname and not os.path.exists(dirname):
+      os.makedirs(dirname)
+    tmp = self.filename + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as outfile:
+      json.dump(entries, outfile)
+    os.replace(tmp, self.filename)
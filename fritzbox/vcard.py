@@ -0,0 +1,228 @@
+# python-fritzbox - Automate the Fritz!Box with python
+# Copyright (C) 2015-2024 Patrick Ammann <pammann@gmx.net>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+#
+
+# Fast vCard parser for the properties used by fritzbox.VCF.Import.get_books_by_cards
+# (N, FN, CATEGORIES, TEL, EMAIL and PHOTO). All other properties are skipped without
+# decoding them. The parsed cards offer the same attributes as vobject components and
+# give the same values, cards using anything not handled here are parsed with vobject.
+
+import re
+import codecs
+import binascii
+import vobject
+
+
+# logical line: [group.]name[;param[=value[,value]]]...:value
+_LINE_HEAD = re.compile(r"(?:[A-Za-z0-9_-]+\.)?([A-Za-z0-9_-]+)((?:;[A-Za-z0-9_-]+(?:=[^\";:]*)?)*):")
+# line end followed by one space or tab continues the line (folding)
+_FOLDING = re.compile(r"\n[ \t]")
+
+_PROPERTIES = ["N", "FN", "CATEGORIES", "TEL", "EMAIL", "PHOTO"]
+_ESCAPABLE = "\\;,Nn\""
+
+
+class Name(object):
+  __slots__ = ("family", "given", "additional", "prefix", "suffix")
+
+  def __init__(self, family="", given="", additional="", prefix="", suffix=""):
+    self.family = family
+    self.given = given
+    self.additional = additional
+    self.prefix = prefix
+    self.suffix = suffix
+
+
+class Property(object):
+  __slots__ = ("name", "params", "_value", "_base64")
+
+  # base64: value is base64 encoded text, decoded to bytes on first access
+  def __init__(self, name, params, value, base64=False):
+    self.name = name
+    self.params = params
+    self._value = value
+    self._base64 = base64
+
+  @property
+  def value(self):
+    if self._base64:
+      self._value = binascii.a2b_base64(self._value.encode("utf-8"))
+      self._base64 = False
+    return self._value
+
+  @property
+  def encoding_param(self):
+    if "ENCODING" not in self.params:
+      raise AttributeError("encoding_param")
+    return self.params["ENCODING"][0]
+
+
+class Card(object):
+  __slots__ = ("_children", "_first")
+
+  def __init__(self):
+    self._children = []
+    self._first = {}
+
+  def add(self, prop):
+    self._children.append(prop)
+    self._first.setdefault(prop.name, prop)
+
+  # first property with this name, e.g. card.tel
+  def __getattr__(self, name):
+    try:
+      return self._first[name.upper().replace("_", "-")]
+    except KeyError:
+      raise AttributeError(name)
+
+  def getChildren(self):
+    return list(self._children)
+
+
+# returns the list of backslash unescaped values separated by separator, None if not supported
+def _split_text(value, separator=",", escapable=_ESCAPABLE):
+  if "\\" not in value:
+    ret = value.split(separator)
+  else:
+    if value.endswith("\\") and (len(value) - len(value.rstrip("\\"))) % 2 == 1:
+      return None
+    ret = []
+    current = []
+    chars = iter(value)
+    for c in chars:
+      if c == "\\":
+        c = next(chars)
+        if c in escapable:
+          current.append("\n" if c in "nN" else c)
+        else:
+          current.append("\\" + c)
+      elif c == separator:
+        ret.append("".join(current))
+        current = []
+      else:
+        current.append(c)
+    ret.append("".join(current))
+  # a trailing separator does not start another value
+  if len(ret) > 1 and ret[-1] == "":
+    ret.pop()
+  return ret
+
+
+# returns ({NAME: [values]}, [parameters without value])
+def _parse_params(text):
+  params = {}
+  singletons = []
+  for param in text.split(";")[1:]:
+    name, sep, values = param.partition("=")
+    values = [v for v in values.split(",") if v]
+    if values:
+      params.setdefault(name.upper(), []).extend(values)
+    else:
+      singletons.append(name)
+  return params, singletons
+
+
+# returns class Property of a logical line, None if not supported
+def _parse_property(name, params_text, value):
+  params, singletons = _parse_params(params_text)
+
+  # quoted-printable is decoded first
+  qp = False
+  encoding = params.get("ENCODING")
+  if encoding and "QUOTED-PRINTABLE" in encoding:
+    qp = True
+    encoding.remove("QUOTED-PRINTABLE")
+    if not encoding:
+      del params["ENCODING"]
+  if "QUOTED-PRINTABLE" in singletons:
+    qp = True
+    singletons.remove("QUOTED-PRINTABLE")
+  if qp:
+    if "ENCODING" in params:
+      return None
+    charset = params["CHARSET"][0] if "CHARSET" in params else "utf-8"
+    value = codecs.decode(value.encode("utf-8"), "quoted-printable").decode(charset)
+
+  if name == "N":
+    fields = _split_text(value, ";", ";")
+    if fields is None:
+      return None
+    for i, field in enumerate(fields):
+      # several values, e.g. two given names, are not supported
+      field = _split_text(field)
+      if field is None or len(field) != 1:
+        return None
+      fields[i] = field[0]
+    return Property(name, params, Name(*fields[:5]))
+  elif name == "CATEGORIES":
+    values = _split_text(value)
+    if values is None:
+      return None
+    return Property(name, params, values)
+  elif name == "PHOTO":
+    if "BASE64" in singletons:
+      params["ENCODING"] = ["B"]
+    if "ENCODING" in params:
+      return Property(name, params, value, base64=True)
+  elif "ENCODING" in params or "BASE64" in singletons:
+    return None
+  values = _split_text(value)
+  if values is None:
+    return None
+  return Property(name, params, values[0])
+
+
+# returns class Card of the vCard text, None if the card needs the full parser
+def parse(text):
+  text = text.replace("\r\n", "\n").replace("\r", "\n")
+  lines = _FOLDING.sub("", text).split("\n")
+  while lines and lines[-1] == "":
+    lines.pop()
+  if len(lines) < 2 or lines[0].upper() != "BEGIN:VCARD" or lines[-1].upper() != "END:VCARD":
+    return None
+
+  card = Card()
+  for i in range(1, len(lines) - 1):
+    line = lines[i]
+    if not line:
+      continue
+    m = _LINE_HEAD.match(line)
+    if m is None:
+      # e.g. quoted parameter values
+      return None
+    name = m.group(1).upper().replace("_", "-")
+    if name in _PROPERTIES:
+      prop = _parse_property(name, m.group(2), line[m.end():])
+      if prop is None:
+        return None
+      card.add(prop)
+    elif name in ["BEGIN", "END"]:
+      # nested components
+      return None
+  return card
+
+
+# returns the parsed vCard text, with vobject if the card needs the full parser
+def readOne(text):
+  try:
+    card = parse(text)
+  except Exception:
+    # e.g. unknown charset, let vobject report it
+    card = None
+  if card is None:
+    card = vobject.readOne(text)
+  return card
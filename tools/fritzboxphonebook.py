@@ -20,8 +20,10 @@
 
 import os
 import sys
+import hashlib
 import argparse
 import logging
+import concurrent.futures
 import traceback
 
 # fritzbox modules
@@ -30,7 +32,51 @@ import fritzbox.phonebook
 import fritzbox.CSV
 import fritzbox.LDIF
 import fritzbox.VCF
+import fritzbox.XML
 import fritzbox.CardDAV
+import fritzbox.uploadstate
+import fritzbox.stats
+import fritzbox.fonpix
+
+
+LOAD_EXTENSIONS = [".csv", ".ldif", ".vcf", ".xml"]
+
+
+# runs in a worker process with --jobs
+def load_books(filename, vip_groups, picture_path, compact, fast_vcf=False, photo_jobs=1, vcf_jobs=1, cache_dir=None):
+    logger = logging.getLogger("fritzboxphonebook")
+    ext = os.path.splitext(filename)[1].lower()
+    if os.path.isdir(filename):
+        vcf = fritzbox.VCF.Import()
+        cache = None
+        if cache_dir:
+            # one cache per directory, directories can be loaded in parallel processes
+            key = hashlib.sha1(os.path.abspath(filename).encode("utf-8")).hexdigest()[:12]
+            cache = fritzbox.VCF.VCardFileCache(os.path.join(cache_dir, "vcf-%s.cache" % key))
+        books = vcf.get_books_dir(filename, vip_groups, picture_path, fast_parser=fast_vcf, jobs=vcf_jobs,
+                                  cache=cache, logger=logger)
+    elif ext == ".csv":
+        csv = fritzbox.CSV.Import()
+        books = csv.get_books(filename, vip_groups, logger=logger)
+    elif ext == ".ldif":
+        ldif = fritzbox.LDIF.Import()
+        books = ldif.get_books(filename, vip_groups, logger=logger)
+    elif ext == ".vcf":
+        vcf = fritzbox.VCF.Import()
+        books = vcf.get_books(filename, vip_groups, picture_path, fast_parser=fast_vcf, photo_jobs=photo_jobs,
+                              jobs=vcf_jobs, logger=logger)
+    elif ext == ".xml":
+        xml = fritzbox.XML.Import()
+        books = xml.get_books(filename, vip_groups, logger=logger)
+    if compact: books.compact()
+    return books
+
+
+# runs in a worker process with --jobs, returns the books and the collected stats
+def load_books_job(filename, vip_groups, picture_path, compact, fast_vcf=False, photo_jobs=1, vcf_jobs=1, cache_dir=None):
+    fritzbox.stats.use(fritzbox.stats.Stats())
+    books = load_books(filename, vip_groups, picture_path, compact, fast_vcf, photo_jobs, vcf_jobs, cache_dir)
+    return books, fritzbox.stats.get().asDict()
 
 
 #
@@ -55,28 +101,61 @@ if __name__ == "__main__":
     # file import
     fileImport = parser.add_argument_group("phonebook load")
     fileImport.add_argument("--load", nargs="+",
-        help="load phonebooks from file by name")
+        help="load phonebooks from file by name, or from directories of *.vcf files (e.g. vdirsyncer)")
     fileImport.add_argument("--country-code", dest="country_code", default="+41",
         help="country code, e.g. +41")
     fileImport.add_argument("--vip-groups", dest="vip_groups", nargs="+", default=["Family"],
         help="vip group names")
+    fileImport.add_argument("--jobs", type=int, default=1,
+        help="number of files loaded in parallel processes")
+    fileImport.add_argument("--fast-vcf", dest="fast_vcf", action="store_true", default=False,
+        help="parse *.vcf files with the fast parser for the properties used in the phonebook, "
+             "cards it does not support are parsed as before")
+    fileImport.add_argument("--vcf-jobs", dest="vcf_jobs", type=int, default=1,
+        help="number of processes parsing parts of one large *.vcf file or the files of a directory, "
+             "pictures are then saved by these processes")
 
     # download from WebDAV server (e.g. Nextcloud)
     downloadWebDAV = parser.add_argument_group("download WebDAV")
     downloadWebDAV.add_argument("--webdav-url", dest="webdav_url", nargs="+",
-        help="webdav URL, e.g. https://<HOST>/remote.php/dav/addressbooks/users/<LOGIN>/<BOOK>/")
+        help="webdav URL, e.g. https://<HOST>/remote.php/dav/addressbooks/users/<LOGIN>/<BOOK>/. "
+             "Several address books are downloaded in parallel")
     downloadWebDAV.add_argument("--webdav-username", dest="webdav_username",
         help="webdav username")
     downloadWebDAV.add_argument("--webdav-password", dest="webdav_password",
         help="webdav password")
+    downloadWebDAV.add_argument("--webdav-jobs", dest="webdav_jobs", type=int, default=1,
+        help="number of parallel downloads")
+    downloadWebDAV.add_argument("--webdav-sync", dest="webdav_sync", action="store_true", default=False,
+        help="only download the changes since the last run (WebDAV sync-collection), needs --cache-dir")
+    downloadWebDAV.add_argument("--webdav-multiget", dest="webdav_multiget", type=int, default=0,
+        help="fetch this many vCards per request (CardDAV addressbook-multiget), e.g. 100. Default: one request per vCard")
+    downloadWebDAV.add_argument("--webdav-discover", dest="webdav_discover", action="store_true", default=False,
+        help="download all address books of the user, --webdav-url is the principal URL, "
+             "e.g. https://<HOST>/remote.php/dav/principals/users/<LOGIN>/")
 
     # misc
     misc = parser.add_argument_group("misc")
     misc.add_argument("--save-pictures", dest="save_pictures", action="store_true", default=False,
         help="Save pictures within VCF to local fonpix folder. "
-                 "The pictures must be uploaded manually to the Fritz!Box NAS (https://fritz.nas path=/fritz.nas/FRITZ/fonpix")
+                 "The pictures must be uploaded manually to the Fritz!Box NAS (https://fritz.nas path=/fritz.nas/FRITZ/fonpix). "
+                 "Unchanged pictures are reused, pictures no longer used are removed from the folder")
+    misc.add_argument("--photo-jobs", dest="photo_jobs", type=int, default=1,
+        help="number of processes resizing the pictures of *.vcf files while the cards are loaded")
     misc.add_argument("--familyname-first", dest="familyname_first", action="store_true", default=False,
         help="In saved phonebook the real name is '<family name> <given name>'. Default: '<given name> <family name>'.")
+    misc.add_argument("--dedup", choices=["first", "newest", "union"],
+        help="Collapse contacts with the same number or name when merging the phonebooks: "
+             "keep the first one, keep the newest one or unite their numbers.")
+    misc.add_argument("--dedup-numbers-only", dest="dedup_numbers_only", action="store_true", default=False,
+        help="Only collapse contacts with the same number, e.g. for blocklists.")
+    misc.add_argument("--cache-dir", dest="cache_dir",
+        help="Directory to keep state between runs, e.g. downloaded vCards or contacts of unchanged files "
+             "in loaded directories. Default: no cache")
+    misc.add_argument("--stats", action="store_true", default=False,
+        help="Print time spent per stage and counters, e.g. number of contacts")
+    misc.add_argument("--compact", action="store_true", default=False,
+        help="Keep loaded phonebooks in a compact in-memory store. Saves memory for big phonebooks, e.g. blocklists.")
 
     # upload
     if False:
@@ -89,8 +168,12 @@ if __name__ == "__main__":
             help="phonebook id: 0 for main phone book, 1 for next phone book in list, etc...")
         upload.add_argument("--cert-verify", dest="cert_verify", action="store_true", default=False,
             help="do not use certificate to verify secure connection. Default is without certificate")
+        upload.add_argument("--upload-state", dest="upload_state",
+            help="state file remembering the last uploaded phonebook, the upload is skipped if nothing changed")
 
     args = parser.parse_args()
+    if args.webdav_sync and not args.cache_dir:
+        parser.error("--webdav-sync needs --cache-dir")
 
     h1 = logging.StreamHandler(sys.stdout)
     h1.setLevel(logging.DEBUG)
@@ -101,6 +184,7 @@ if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO)
     if args.debug:
         logging.getLogger().setLevel(logging.DEBUG)
+    logging.getLogger().addHandler(fritzbox.stats.WarningCounter())
 
     picture_path = None
     if args.save_pictures:
@@ -113,44 +197,57 @@ if __name__ == "__main__":
         logger = logging.getLogger("fritzboxphonebook")
         books = None
         if args.load:
-            books = fritzbox.phonebook.Phonebooks()
             for f in args.load:
-                print("load phonebook from %s" % f)
                 ext = os.path.splitext(f)[1].lower()
-                if ext == ".csv":
-                    csv = fritzbox.CSV.Import()
-                    tmp = csv.get_books(f, args.vip_groups, logger=logger)
-                    books.addPhonebooks(tmp)
-                elif ext == ".ldif":
-                    ldif = fritzbox.LDIF.Import()
-                    tmp = ldif.get_books(f, args.vip_groups, logger=logger)
-                    books.addPhonebooks(tmp)
-                elif ext == ".vcf":
-                    vcf = fritzbox.VCF.Import()
-                    tmp = vcf.get_books(f, args.vip_groups, picture_path, logger=logger)
-                    books.addPhonebooks(tmp)
-                else:
-                    print("error: file format not supported '%s'. Supported are *.ldif, *.csv and *.vcf files." % ext)
+                if ext not in LOAD_EXTENSIONS and not os.path.isdir(f):
+                    print("error: file format not supported '%s'. Supported are *.ldif, *.csv, *.vcf and *.xml files "
+                          "and directories of *.vcf files." % ext)
                     sys.exit(-1)
+            books = fritzbox.phonebook.Phonebooks()
+            load_args = (args.vip_groups, picture_path, args.compact, args.fast_vcf, args.photo_jobs, args.vcf_jobs,
+                         args.cache_dir)
+            if args.jobs > 1:
+                # results are merged in the order of the files, same as loading one after another
+                with concurrent.futures.ProcessPoolExecutor(max_workers=args.jobs) as executor:
+                    futures = []
+                    for f in args.load:
+                        print("load phonebook from %s" % f)
+                        futures.append(executor.submit(load_books_job, f, *load_args))
+                    for future in futures:
+                        tmp, stats = future.result()
+                        books.addPhonebooks(tmp)
+                        fritzbox.stats.get().add(stats)
+            else:
+                for f in args.load:
+                    print("load phonebook from %s" % f)
+                    books.addPhonebooks(load_books(f, *load_args))
         elif args.webdav_url:
             dav = fritzbox.CardDAV.Import()
-            books = fritzbox.phonebook.Phonebooks()
+            cache = None
+            if args.cache_dir:
+                cache = fritzbox.CardDAV.VCardCache(os.path.join(args.cache_dir, "carddav.cache"))
             for url in args.webdav_url:
                 print("download phonebook from %s" % url)
-                tmp = dav.get_books(url, args.webdav_username, args.webdav_password,
-                                    args.vip_groups, picture_path, logger=logger)
-                books.addPhonebooks(tmp)
+            books = dav.get_books_multi(args.webdav_url, args.webdav_username, args.webdav_password,
+                                        args.vip_groups, picture_path, jobs=args.webdav_jobs, multiget=args.webdav_multiget,
+                                        cache=cache, sync=args.webdav_sync, discover=args.webdav_discover, logger=logger)
+            if args.compact: books.compact()
 
         # post process
         if books:
             books.normalizeNumbers(args.country_code)
             books.calculateMainNumber()
-            books.mergeToOnePhonebook()
+            collapsed = books.mergeToOnePhonebook(args.dedup, matchNames=not args.dedup_numbers_only)
+            if args.dedup:
+                print("collapsed %d duplicate contacts" % collapsed)
+            if picture_path and os.path.exists(picture_path):
+                removed = fritzbox.fonpix.cleanup(picture_path, books)
+                print("removed %d unused pictures from %s" % (removed, picture_path))
 
+        optionsXML = fritzbox.phonebook.OptionsXML()
+        optionsXML.familyNameFirst = args.familyname_first
         if args.save:
             print("save phonebook to %s" % args.save)
-            optionsXML = fritzbox.phonebook.OptionsXML()
-            optionsXML.familyNameFirst = args.familyname_first
             books.write(args.save, optionsXML)
         if False:
             if args.save_cert:
@@ -160,7 +257,12 @@ if __name__ == "__main__":
             elif args.upload:
                 print("upload phonebook to %s" % args.hostname)
                 session = fritzbox.access.Session(args.password, url=args.hostname, cert_verify=args.cert_verify, logger=logger)
-                books.upload(session, args.phonebook_id)
+                state = None
+                if args.upload_state:
+                    state = fritzbox.uploadstate.UploadState(args.upload_state, args.hostname, args.phonebook_id)
+                changes = books.upload(session, args.phonebook_id, optionsXML, state)
+                if changes is not None:
+                    print("contacts added: %(added)d, removed: %(removed)d, changed: %(changed)d" % changes)
             elif args.test_access:
                 print("test access to %s" % args.hostname)
                 session = fritzbox.access.Session(args.password, url=args.hostname, cert_verify=args.cert_verify, logger=logger)
@@ -170,3 +272,6 @@ if __name__ == "__main__":
         logging.error(ex)
         logging.debug(traceback.format_exc())
         sys.exit(-2)
+
+    if args.stats:
+        print(fritzbox.stats.get().format())